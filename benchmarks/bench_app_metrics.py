@@ -0,0 +1,84 @@
+"""
+Đo overhead của utils.app_metrics trên mỗi interaction.
+
+Mô phỏng một interaction gồm preprocess, một lời gọi API, postprocess và vài
+lần render (các hàm giả, không cần Streamlit), chạy có và không có lớp đo.
+
+Chạy: python benchmarks/bench_app_metrics.py [--interactions 2000 --renders 4]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.app_metrics import AppMetrics
+
+
+def _busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _build(metrics: AppMetrics | None, renders: int):
+    def call_model_api():
+        _busy(0.0005)
+        return {"ok": True}
+
+    def render():
+        _busy(0.0001)
+
+    if metrics is not None:
+        call_model_api = metrics.instrument_api(call_model_api)
+        render = metrics.instrument_render(render)
+
+    def main():
+        _busy(0.0002)
+        result = call_model_api()
+        _busy(0.0002)
+        for _ in range(renders):
+            render()
+        return result
+
+    if metrics is not None:
+        # Không có Streamlit ở đây, render_debug_panel tự bỏ qua
+        main = metrics.interaction(main)
+    return main
+
+
+def _run(main, interactions: int) -> list[float]:
+    durations = []
+    for _ in range(interactions):
+        start = time.perf_counter()
+        main()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interactions", type=int, default=2000)
+    parser.add_argument("--renders", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = AppMetrics("bench", metrics_dir=tmp)
+        baseline = _run(_build(None, args.renders), args.interactions)
+        instrumented = _run(_build(metrics, args.renders), args.interactions)
+
+        base_p50 = statistics.median(baseline) * 1000
+        inst_p50 = statistics.median(instrumented) * 1000
+        print(f"📊 baseline      p50 {base_p50:.3f} ms")
+        print(f"📊 instrumented  p50 {inst_p50:.3f} ms (+{inst_p50 - base_p50:.3f} ms / interaction)")
+        overhead = metrics.percentiles().get("overhead", {})
+        if overhead:
+            print(f"📊 recording overhead p50 {overhead['p50'] * 1000:.3f} ms, "
+                  f"p99 {overhead['p99'] * 1000:.3f} ms; JSON-lines every {metrics.jsonl_every}")
+
+
+if __name__ == "__main__":
+    main()
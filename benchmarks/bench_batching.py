@@ -0,0 +1,96 @@
+"""
+So sánh throughput khi gửi mỗi item một request (cách UI đang làm) và khi dùng
+utils.batching.MicroBatcher cho API nhận list (vd. tabular QA `queries`).
+
+Server giả lập chạy cục bộ: mỗi request tốn một khoản cố định (mạng, parse,
+nạp bảng) cộng thêm chi phí cho từng query, và chỉ xử lý `--server-workers`
+request cùng lúc như một model server thật.
+
+Chạy: python benchmarks/bench_batching.py [--items 200 --request-ms 40 --item-ms 3]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import sample_data
+from utils.batching import MicroBatcher, detect_batch_spec
+
+
+def _serve(request_ms: float, item_ms: float, server_workers: int) -> ThreadingHTTPServer:
+    slots = threading.Semaphore(server_workers)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with slots:
+                time.sleep((request_ms + item_ms * len(body["queries"])) / 1000)
+            response = json.dumps({"answers": [f"answer to {q}" for q in body["queries"]]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--request-ms", type=float, default=40)
+    parser.add_argument("--item-ms", type=float, default=3)
+    parser.add_argument("--server-workers", type=int, default=2)
+    args = parser.parse_args()
+
+    server = _serve(args.request_ms, args.item_ms, args.server_workers)
+    url = f"http://127.0.0.1:{server.server_port}/predict"
+    session = requests.Session()
+    template = sample_data.SAMPLE_TABULAR_PAYLOAD
+    items = [f"Question {i}: who scored the most points?" for i in range(args.items)]
+
+    def send(payload):
+        response = session.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def one_per_call(item):
+        return send({**template, "queries": [item]})["answers"][0]
+
+    verified_output = send(template)
+    input_format = {"structure": {"table": {"type": "object"}, "queries": {"type": "list", "description": "questions"}}}
+    spec = detect_batch_spec(input_format, template, verified_output, probe=send)
+    print(f"Detected batch spec: {spec}")
+
+    def run(label, fn):
+        start = time.perf_counter()
+        results = fn()
+        elapsed = time.perf_counter() - start
+        assert len(results) == len(items)
+        print(f"📊 {label:<32} {elapsed:6.2f}s  {len(items) / elapsed:7.1f} items/s")
+        return elapsed
+
+    baseline = run("one item per call, serial", lambda: [one_per_call(item) for item in items])
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        run("one item per call, 4 workers", lambda: list(pool.map(one_per_call, items)))
+    batched = run("micro-batch x16, 1 worker", lambda: MicroBatcher(send, template, spec).map(items))
+    run("micro-batch x16, 2 workers", lambda: MicroBatcher(send, template, {**spec, "workers": 2}).map(items))
+    print(f"📊 speed-up micro-batch vs serial: x{baseline / batched:.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Đo peak RSS của luồng dữ liệu step1b -> step1c -> step2 cho một tác vụ ảnh,
+trước (giá trị thô trong task_info) và sau (tham chiếu blob store).
+
+Chạy: python benchmarks/bench_blob_store.py [--image-mb 8]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import blob_store
+from components.step1c_generate_api_handler import is_base64_image, compress_data
+
+ATTEMPTS = 4
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _build_payload(image_mb: float) -> dict:
+    raw = b"\xff\xd8\xff\xe0" + os.urandom(int(image_mb * 1024 * 1024))
+    return {"data": base64.b64encode(raw).decode("ascii")}
+
+
+def _run_flow(mode: str, image_mb: float):
+    sink = io.StringIO()
+    payload = _build_payload(image_mb)
+    response = {"depth": [[float(i % 97) for i in range(640)] for _ in range(256)]}
+    baseline = _peak_rss_mb()
+
+    # Step 1b: in payload ở mỗi lần thử và sau khi thành công
+    for _ in range(ATTEMPTS):
+        if mode == "legacy":
+            sink.write(json.dumps(payload, indent=2))
+        else:
+            sink.write(json.dumps(blob_store.summarize(payload), indent=2))
+        sink.seek(0)
+        sink.truncate()
+
+    if mode == "legacy":
+        model_io = {"verified_input": payload, "verified_output": response}
+    else:
+        model_io = {
+            "verified_input": blob_store.externalize(payload),
+            "verified_output": blob_store.externalize(response),
+        }
+    del payload, response
+
+    # Step 1c: duyệt đệ quy và nén dữ liệu lớn
+    for key in ("verified_input", "verified_output"):
+        if not is_base64_image(model_io[key]):
+            compress_data(model_io[key])
+
+    # Step 2: đưa dữ liệu vào prompt
+    prompt = "\n".join(
+        json.dumps(model_io[key], indent=2, ensure_ascii=False, default=blob_store.json_default)
+        for key in ("verified_input", "verified_output")
+    )
+
+    # Consumer cuối: dựng lại payload thật để gửi API
+    if mode == "blob":
+        materialized = blob_store.materialize(model_io["verified_input"])
+        assert materialized["data"].startswith("/9j/")
+        del materialized
+
+    print(json.dumps({
+        "mode": mode,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "prompt_chars": len(prompt),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS benchmark for the blob store.")
+    parser.add_argument("--image-mb", type=float, default=8.0)
+    parser.add_argument("--mode", choices=["legacy", "blob"])
+    args = parser.parse_args()
+
+    if args.mode:
+        _run_flow(args.mode, args.image_mb)
+        return
+
+    for mode in ("legacy", "blob"):
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--image-mb", str(args.image_mb)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+So sánh bytes/request và độ trễ end-to-end khi gửi ảnh gốc (cách handler đang làm)
+và khi qua utils.image_codec (thu nhỏ + nén lại + cache theo upload).
+
+Server giả lập chạy cục bộ: giải mã base64, mở ảnh và resize về độ phân giải
+model như phía server thật, rồi trả về vài bounding box.
+
+Chạy: python benchmarks/bench_image_codec.py [--width 4000 --height 3000 --requests 10]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import image_codec
+
+MODEL_SIDE = 640
+
+
+class _ModelHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        image = Image.open(io.BytesIO(base64.b64decode(json.loads(body)["data"])))
+        image.thumbnail((MODEL_SIDE, MODEL_SIDE))
+        w, h = image.size
+        response = json.dumps({"boxes": [[w * 0.1, h * 0.1, w * 0.5, h * 0.5]], "size": [w, h]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+def _make_photo(width: int, height: int) -> bytes:
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, max(1, width // 20)):
+        draw.ellipse([i, i * height // width, i + width // 8, i * height // width + height // 8],
+                     fill=(i % 255, 120, 255 - i % 255))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _measure(label: str, url: str, upload: bytes, encode, n: int):
+    latencies, sizes = [], []
+    for _ in range(n):
+        start = time.perf_counter()
+        data, prepared = encode(upload)
+        payload = json.dumps({"data": data})
+        response = requests.post(url, data=payload, headers={"Content-Type": "application/json"}, timeout=60).json()
+        if prepared is not None:
+            image_codec.map_to_original(response, prepared)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(payload))
+    print(f"{label:<28} bytes/request={statistics.mean(sizes):>12,.0f}  "
+          f"latency p50={statistics.median(latencies) * 1000:7.1f}ms  "
+          f"first={latencies[0] * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image codec benchmark.")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ModelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/predict"
+
+    upload = _make_photo(args.width, args.height)
+    print(f"Upload: {args.width}x{args.height} JPEG, {len(upload):,} bytes; model side {MODEL_SIDE}px")
+
+    spec = {**image_codec.default_spec(), "max_side": MODEL_SIDE}
+    _measure("raw upload (before)", url, upload,
+             lambda raw: (base64.b64encode(raw).decode("ascii"), None), args.requests)
+    _measure("image_codec (after)", url, upload,
+             lambda raw: (image_codec.prepare_image(raw, spec).b64, image_codec.prepare_image(raw, spec)),
+             args.requests)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import os
+import re
+import copy
 import json
-import requests
 import time
 from typing import Optional, Dict
-from utils import payload_builder
+from utils import payload_builder, blob_store, image_codec, api_cassette, batching
 from utils.langchain import create_llm_chain
-from config import GENERATOR_MODEL
+from config import BATCHING_ENABLED
 
 def _get_payload_from_llm(input_format_desc: str, error_info: str = "") -> Dict:
     print(">>> Using LLM to generate payload...")
@@ -23,7 +24,7 @@ def _get_payload_from_llm(input_format_desc: str, error_info: str = "") -> Dict:
     if error_info:
         user_prompt += f"\n\nPrevious attempt failed with error: {error_info}\nPlease analyze and create a corrected payload."
     
-    chain = create_llm_chain(prompt_system, model=GENERATOR_MODEL, temperature=0.1)
+    chain = create_llm_chain(prompt_system, temperature=0.1, tier="payload")
     payload_str = chain.invoke({"user_prompt": user_prompt})
     
     try:
@@ -38,10 +39,12 @@ def _get_payload_from_llm(input_format_desc: str, error_info: str = "") -> Dict:
         return json.loads(payload_str)
 
 
-def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retries: int = 3) -> tuple[dict, dict]:
+def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retries: int = 3,
+                                 image_spec: dict | None = None) -> tuple[dict, dict]:
     """
     Sử dụng phương pháp kết hợp: thử builder trước, nếu thất bại thì dùng LLM.
     Sau đó gửi yêu cầu API với logic retry.
+    Ảnh base64 trong payload được thu nhỏ/nén theo image_spec giống như ở app được sinh ra.
     """
     payload = {}
     used_llm = False
@@ -59,14 +62,18 @@ def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retr
         payload = _get_payload_from_llm(json.dumps(input_format_desc, indent=2))
         print("✅ Payload generated using LLM fallback.")
 
+    if image_codec.payload_has_image(payload):
+        payload = image_codec.prepare_payload_images(payload, image_spec)
+
     print("Final payload to be sent:")
-    print(json.dumps(payload, indent=2))
+    print(json.dumps(blob_store.summarize(payload), indent=2))
 
     # Vòng lặp retry
     for attempt in range(max_retries + 1):
         try:
             print(f">>> Attempt {attempt + 1}/{max_retries + 1}: Sending API request...")
-            response = requests.post(api_url, json=payload, timeout=30)
+            # Qua cassette: ghi/phát lại theo API_CASSETTE_MODE
+            response = api_cassette.post(api_url, json=payload, timeout=30)
             response.raise_for_status()  # Sẽ ném exception cho mã lỗi 4xx/5xx
             
             # Kiểm tra response có phải JSON hợp lệ không
@@ -83,6 +90,10 @@ def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retr
             print("✅ API request and response verification successful!")
             return payload, response_json
 
+        except api_cassette.CassetteMiss:
+            # Chạy offline: tạo payload mới cũng không có bản ghi tương ứng
+            print("❌ No recorded response for this payload. Record it first with API_CASSETTE_MODE=record.")
+            raise
         except Exception as e:
             error_info = str(e)
             print(f"⚠️ API call attempt {attempt + 1} failed: {error_info}")
@@ -99,9 +110,11 @@ def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retr
                 error_info="\n".join(error_history)
             )
             used_llm = True
+            if image_codec.payload_has_image(payload):
+                payload = image_codec.prepare_payload_images(payload, image_spec)
             
             print("New payload generated:")
-            print(json.dumps(payload, indent=2))
+            print(json.dumps(blob_store.summarize(payload), indent=2))
             
             delay_seconds = 3 * (attempt + 1)
             print(f"⏳ Waiting {delay_seconds} seconds before next retry...")
@@ -110,14 +123,7 @@ def _make_api_request_with_retry(api_url: str, input_format_desc: dict, max_retr
     raise ConnectionError("Could not get a valid response from the API after all retries.")
 
 
-def run(task_info: dict) -> Optional[dict]:
-    """
-    Verifies the model's I/O using the hybrid (Builder + LLM) approach.
-    """
-    print("--- Running Step 1b: Verify Model I/O via Live API Call (Hybrid Approach) ---")
-    api_url = task_info["model_information"].get("api_url")
-    
-    # Xử lý input format
+def _normalize_input_format(task_info: dict) -> dict:
     input_format_desc = task_info["model_io"]["input_format"]
     
     # Tự động sửa lỗi chính tả phổ biến
@@ -134,18 +140,161 @@ def run(task_info: dict) -> Optional[dict]:
             "structure": input_format_desc
         }
         input_format_desc = task_info["model_io"]["input_format"]
+    return input_format_desc
+
+
+_SAMPLE_VALUES = (
+    (("bool", "boolean"), False),
+    (("int", "integer"), 0),
+    (("float", "number", "double"), 0.0),
+    (("str", "string", "text", "base64", "url"), "sample"),
+)
+_LIST_TYPES = ("list", "array", "sequence", "tuple")
+
+
+def _sample_for_type(field_type: str):
+    """
+    Giá trị mẫu cho một mô tả kiểu: kiểu list được xét trước (List[float], float[],
+    "array of integers"), sau đó mới tới kiểu vô hướng, so khớp theo nguyên từ.
+    """
+    field_type = field_type.strip()
+    match = re.fullmatch(r"(\w+)\s*\[(.*)\]", field_type)
+    if match and match.group(1) in _LIST_TYPES:
+        inner = match.group(2).strip()
+        return [_sample_for_type(inner)] if inner else []
+    match = re.fullmatch(r"(.+?)\s*\[\]", field_type)
+    if match:
+        return [_sample_for_type(match.group(1))]
+    words = re.findall(r"[a-z0-9]+", field_type)
+    # Bỏ "s" số nhiều: "integers" -> "integer", "floats" -> "float"
+    words = [word[:-1] if word.endswith("s") and word[:-1] else word for word in words]
+    if words and words[0] in _LIST_TYPES:
+        match = re.search(r"\bof\s+(.+)$", field_type)
+        return [_sample_for_type(match.group(1))] if match else []
+    for names, value in _SAMPLE_VALUES:
+        if any(word in names for word in words):
+            return value
+    if any(word in _LIST_TYPES for word in words):
+        return []
+    return "sample"
+
+
+def _example_from_structure(structure):
+    """Giá trị mẫu theo mô tả kiểu trong output_format (chỉ cần đúng khung, không cần đúng giá trị)."""
+    if not isinstance(structure, dict):
+        return None
+    example = {}
+    for key, field_info in structure.items():
+        if not isinstance(field_info, dict):
+            example[key] = "sample"
+            continue
+        nested = field_info.get("structure") or field_info.get("properties")
+        field_type = str(field_info.get("type", "")).lower()
+        if isinstance(nested, dict):
+            example[key] = _example_from_structure(nested)
+        elif "type" not in field_info:
+            example[key] = _example_from_structure(field_info)
+        else:
+            example[key] = _sample_for_type(field_type)
+            if isinstance(example[key], list) and isinstance(field_info.get("items"), dict):
+                item = _example_from_structure({"item": field_info["items"]})
+                example[key] = [item["item"]]
+    return example
+
+
+def predict(task_info: dict) -> Optional[dict]:
+    """
+    Dự đoán kết quả của run() từ schema, không gọi API: input từ payload builder,
+    output từ `structure` của output_format. Dùng để chạy trước step1c/step2
+    trong lúc step1b còn đang xác minh. Trả về None nếu schema không đủ thông tin.
+    """
+    predicted = copy.deepcopy(task_info)
+    output_format = predicted["model_io"].get("output_format") or {}
+    predicted_output = _example_from_structure(output_format.get("structure")) if isinstance(output_format, dict) else None
+    if not predicted_output or not predicted["model_io"].get("input_format"):
+        return None
+    input_format_desc = _normalize_input_format(predicted)
+    try:
+        predicted_input = payload_builder.build_payload_from_schema(input_format_desc)
+    except Exception:
+        return None
+
+    if image_codec.payload_has_image(predicted_input):
+        predicted_input = image_codec.prepare_payload_images(predicted_input, image_codec.spec_from_task(input_format_desc))
+        predicted["model_io"]["image_spec"] = image_codec.resolve_spec(input_format_desc, predicted_output)
+    predicted["model_io"]["verified_input"] = blob_store.externalize(predicted_input)
+    predicted["model_io"]["verified_output"] = blob_store.externalize(predicted_output)
+    return predicted
+
+
+def prediction_differences(predicted: dict, verified: dict) -> list[str]:
+    """
+    Các điểm mà kết quả xác minh thật khác với dự đoán (rỗng = có thể giữ kết quả suy đoán).
+    List dự đoán rỗng (schema không có `items`) không khớp với list thật có phần tử,
+    vì prompt step1c/step2 chưa thấy cấu trúc phần tử thật.
+    """
+    differences = []
+    for key in ("verified_input", "verified_output"):
+        diffs = api_cassette.structure_diff(api_cassette.structure(predicted["model_io"].get(key)),
+                                            api_cassette.structure(verified["model_io"].get(key)),
+                                            strict_empty=True)
+        differences += [f"{key}: {diff}" for diff in diffs]
+    if predicted["model_io"].get("image_spec") != verified["model_io"].get("image_spec"):
+        differences.append("image_spec changed")
+    # Step1c sinh handler khác nhau tuỳ field được batch: so spec run() đã dò (có probe) trên
+    # I/O thật với spec step1c sẽ dò trên I/O dự đoán
+    batch_fields = [_batch_fields(io) for io in (predicted["model_io"], verified["model_io"])]
+    if batch_fields[0] != batch_fields[1]:
+        differences.append(f"batch_spec: {batch_fields[0]} -> {batch_fields[1]}")
+    return differences
+
+
+def _batch_fields(model_io: dict) -> tuple | None:
+    if "batch_spec" in model_io:
+        spec = model_io["batch_spec"]
+    else:
+        spec = batching.detect_batch_spec(model_io["input_format"], model_io.get("verified_input"),
+                                          model_io.get("verified_output"),
+                                          output_format=model_io.get("output_format"))
+    return (tuple(spec["input_path"]), tuple(spec["output_path"])) if spec else None
+
+
+def run(task_info: dict) -> Optional[dict]:
+    """
+    Verifies the model's I/O using the hybrid (Builder + LLM) approach.
+    """
+    print("--- Running Step 1b: Verify Model I/O via Live API Call (Hybrid Approach) ---")
+    api_url = task_info["model_information"].get("api_url")
+    
+    # Xử lý input format
+    input_format_desc = _normalize_input_format(task_info)
 
     try:
         verified_input, verified_output = _make_api_request_with_retry(
-            api_url, input_format_desc, max_retries=3
+            api_url, input_format_desc, max_retries=3,
+            image_spec=image_codec.spec_from_task(input_format_desc)
         )
         
-        # CẬP NHẬT TASK_INFO
-        task_info["model_io"]["verified_input"] = verified_input
-        task_info["model_io"]["verified_output"] = verified_output
+        # CẬP NHẬT TASK_INFO: giá trị lớn được thay bằng tham chiếu tới blob store
+        task_info["model_io"]["verified_input"] = blob_store.externalize(verified_input)
+        task_info["model_io"]["verified_output"] = blob_store.externalize(verified_output)
+
+        # Độ phân giải/định dạng ảnh đích cho API handler và UI được sinh ra
+        if image_codec.payload_has_image(verified_input):
+            image_spec = image_codec.resolve_spec(input_format_desc, verified_output)
+            task_info["model_io"]["image_spec"] = image_spec
+            print(f"✅ Image spec ({image_spec['source']}): max side {image_spec['max_side']}px, {image_spec['format']}")
+
+        # API có nhận nhiều item trong một request không: dò một lần ở đây (probe thật) để
+        # so với I/O dự đoán; step1c dùng lại kết quả và chỉ áp giới hạn theo profile
+        if BATCHING_ENABLED:
+            task_info["model_io"]["batch_spec"] = batching.detect_batch_spec(
+                input_format_desc, verified_input, verified_output,
+                output_format=task_info["model_io"].get("output_format"),
+                probe=batching.cassette_probe(api_url, timeout=30))
 
         print("✅ Model I/O verification successful.")
-        print(f"Verified input: {json.dumps(verified_input, indent=2)}")
+        print(f"Verified input: {json.dumps(task_info['model_io']['verified_input'], indent=2, default=blob_store.json_default)}")
         return task_info
 
     except Exception as e:
@@ -3,13 +3,22 @@ import json
 import re
 import traceback
 import zlib
-from utils.helpers import read_file, clean_llm_output
+from utils.helpers import read_file
 from utils.langchain import create_llm_chain
 from utils.context import TaskContext
-from config import PROMPTS_DIR, GENERATOR_MODEL
+from utils.blob_store import BlobRef, json_default
+from utils.streaming import generate_code, StreamCancelled
+from utils.image_codec import prompt_section
+from utils import api_profiler, batching
+from config import BATCHING_ENABLED
+from config import PROMPTS_DIR, GENERATED_CODE_DIR
 
 def is_base64_image(data):
     """Check recursively if input contains base64-encoded image string"""
+    # Giá trị đã được đưa vào blob store
+    if isinstance(data, BlobRef):
+        return data.kind == "base64_image"
+
     # Xử lý chuỗi
     if isinstance(data, str):
         stripped = data.strip()
@@ -44,13 +53,13 @@ def is_base64_image(data):
 
 def compress_data(data: dict | list) -> str:
     """Nén dữ liệu lớn để giảm kích thước token"""
-    json_str = json.dumps(data)
+    json_str = json.dumps(data, default=json_default)
     if len(json_str) > 5000:  # Chỉ nén khi dữ liệu đủ lớn
         compressed = zlib.compress(json_str.encode())
         return f"<COMPRESSED_DATA:{len(compressed)}>"
     return json_str
 
-def run(task_info: dict) -> dict | None:
+def run(task_info: dict, cancel_event=None) -> dict | None:
     print("--- Running Step 1c: Generate API Handler & Post-processing Logic ---")
     
     try:
@@ -72,7 +81,7 @@ def run(task_info: dict) -> dict | None:
         user_prompt_template = read_file(prompt_path)
         
         system_prompt = "You are an expert Python developer. Generate ONLY the API handling function and post-processing logic based on the specification."
-        chain = create_llm_chain(system_prompt, model=GENERATOR_MODEL, temperature=0.1)
+        chain = create_llm_chain(system_prompt, temperature=0.1, tier="handler")
         
         task_description = task_info.get("task_description", {})
         visualize = task_description.get("visualize", {}) if isinstance(task_description, dict) else {}
@@ -133,6 +142,25 @@ def run(task_info: dict) -> dict | None:
             "output_format_summary": str(context.get("output_format", {}).keys())
         }
 
+        # API nhận nhiều item trong một request: sinh thêm handler micro-batching
+        batch_spec = None
+        if BATCHING_ENABLED and "batch_spec" in model_io:
+            # Step1b đã dò (có probe) trên I/O thật; chỉ áp giới hạn theo profile
+            batch_spec = batching.with_profile(model_io["batch_spec"], model_io.get("api_profile"))
+        elif BATCHING_ENABLED:
+            # I/O dự đoán (chạy suy đoán): probe chỉ được gửi khi có list output cùng độ dài
+            # với list input, nên list mẫu 0-1 phần tử không bao giờ gọi API
+            profile = model_io.get("api_profile")
+            timeout = ((profile or {}).get("settings") or api_profiler.DEFAULT_SETTINGS)["timeout"]
+            batch_spec = batching.detect_batch_spec(
+                model_io.get("input_format"), model_io.get("verified_input"), model_io.get("verified_output"),
+                profile, output_format=model_io.get("output_format"),
+                probe=batching.cassette_probe(context.get("api_url", ""), timeout))
+        if batch_spec:
+            print(f"✅ API accepts batches: {batch_spec['input_path']} -> {batch_spec['output_path']} "
+                  f"(max {batch_spec['max_items']} items)")
+        model_io["batch_spec"] = batch_spec
+
         prompt_variables = {
             "api_url": context.get("api_url", ""),
             "input_function": input_function,
@@ -140,7 +168,10 @@ def run(task_info: dict) -> dict | None:
             "verified_input": verified_input_str,
             "verified_output": verified_output_str,
             "post_processing": json.dumps(post_processing, indent=2)[:5000] + ("..." if len(json.dumps(post_processing)) > 5000 else ""),
-            "context": json.dumps(optimized_context, indent=2)
+            "context": json.dumps(optimized_context, indent=2),
+            "image_preprocessing_section": prompt_section(model_io.get("image_spec")),
+            "api_client_section": api_profiler.prompt_section(model_io.get("api_profile")),
+            "batching_section": batching.prompt_section(batch_spec)
         }
 
         print(f"Prompt size before optimization: {sum(len(str(v)) for v in prompt_variables.values())} chars")
@@ -162,8 +193,10 @@ def run(task_info: dict) -> dict | None:
         
         print(f"Final prompt size: {len(user_prompt)} chars")
         
-        generated_code = chain.invoke({"user_prompt": user_prompt})
-        cleaned_code = clean_llm_output(generated_code)
+        safe_task_name = re.sub(r'\s+', '_', task_info.get("task_name", "unknown_task"))
+        stream_path = os.path.join(GENERATED_CODE_DIR, f"{safe_task_name}_api_handler.py.stream")
+        cleaned_code, _ = generate_code(chain, user_prompt, stream_path=stream_path, label="Step 1c",
+                                        cancel_event=cancel_event)
         
         signature_match = re.search(r"def\s+(call_model_api|api_handler)\(([^)]+)\)", cleaned_code)
         if signature_match:
@@ -175,6 +208,9 @@ def run(task_info: dict) -> dict | None:
         print("✅ API handler code generated.")
         return task_info
     
+    except StreamCancelled:
+        print("⏹️ Step 1c cancelled.")
+        return None
     except Exception as e:
         print(f"❌ Error generating API handler: {e}")
         traceback.print_exc()
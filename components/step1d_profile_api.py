@@ -0,0 +1,49 @@
+import copy
+from typing import Optional
+from utils import api_profiler
+from config import API_CASSETTE_MODE
+
+def run(task_info: dict) -> Optional[dict]:
+    """
+    Profiles the verified model API (concurrency and payload-size sweeps) and stores
+    the result in task_info["model_io"]["api_profile"] for Step 1c/2.
+    """
+    print("--- Running Step 1d: Profile Model API ---")
+    if API_CASSETTE_MODE == "replay":
+        # Không có API thật để đo: dùng profile đã lưu nếu có
+        cached = api_profiler.load_cached(task_info["model_information"].get("api_url", ""))
+        task_info["model_io"]["api_profile"] = cached
+        print("⚠️ Cassette replay mode: skipping live profiling" + (", using cached profile." if cached else "."))
+        return task_info
+
+    api_url = task_info["model_information"].get("api_url")
+    try:
+        profile = api_profiler.profile_endpoint(api_url, task_info["model_io"]["verified_input"])
+    except Exception as e:
+        # Profiling chỉ là tối ưu: lỗi ở đây không làm dừng pipeline
+        print(f"⚠️ API profiling failed, using default handler settings: {e}")
+        task_info["model_io"]["api_profile"] = None
+        return task_info
+
+    api_profiler.save_cached(profile)
+    task_info["model_io"]["api_profile"] = profile
+    print(f"✅ API profile: {profile['settings']} (saturation at concurrency {profile['saturation_concurrency']})")
+    return task_info
+
+
+def predict(task_info: dict) -> Optional[dict]:
+    """Profile của lần chạy trước cho cùng API URL, để chạy trước step1c/step2."""
+    cached = api_profiler.load_cached(task_info["model_information"].get("api_url", ""))
+    if not cached:
+        return None
+    predicted = copy.deepcopy(task_info)
+    predicted["model_io"]["api_profile"] = cached
+    return predicted
+
+
+def prediction_differences(predicted: dict, profiled: dict) -> list[str]:
+    """Khác biệt giữa cấu hình handler suy ra từ profile cũ và profile vừa đo."""
+    old = (predicted["model_io"].get("api_profile") or {}).get("settings") or api_profiler.DEFAULT_SETTINGS
+    new = (profiled["model_io"].get("api_profile") or {}).get("settings") or api_profiler.DEFAULT_SETTINGS
+    return [f"{key}: {old.get(key)} -> {new.get(key)}"
+            for key in ("timeout", "max_retries", "workers") if old.get(key) != new.get(key)]
@@ -1,13 +1,19 @@
 import os
 import json
 import re
-from utils.helpers import read_file, clean_llm_output
+from utils.helpers import read_file
 from utils.langchain import create_llm_chain
 from utils.component_parser import extract_ui_components
 from utils.context import TaskContext
-from config import GENERATED_CODE_DIR, PROMPTS_DIR, GENERATOR_MODEL
+from utils.blob_store import json_default
+from utils.streaming import generate_code, StreamCancelled
+from utils.image_codec import prompt_section
+from utils import api_profiler, batching
+from utils.app_metrics import inject_instrumentation
+from utils.api_cassette import inject_install
+from config import GENERATED_CODE_DIR, PROMPTS_DIR, APP_METRICS_ENABLED
 
-def run(task_info: dict) -> str | None:
+def run(task_info: dict, cancel_event=None) -> str | None:
 
     print("--- Running Step 2: Generate UI Code ---")
 
@@ -57,20 +63,20 @@ def run(task_info: dict) -> str | None:
     verified_input = task_info.get("model_io", {}).get("verified_input", {})
     verified_output = task_info.get("model_io", {}).get("verified_output", {})
     
-    # Prepare port
-    port = 8080
-    
+    # Port không còn cố định: supervisor ở step3 cấp phát port khi khởi chạy app
 
     # Format user prompt
     prompt_variables = {
         "task_type": task_type,
         "task_description": json.dumps(task_description_full, indent=2, ensure_ascii=False),
-        "port": port,
         "visualize_features": visualize_features,
         "api_url": task_info.get("model_information", {}).get("api_url", ""),
-        "verified_input": json.dumps(verified_input, indent=2, ensure_ascii=False),
-        "verified_output": json.dumps(verified_output, indent=2, ensure_ascii=False),
+        "verified_input": json.dumps(verified_input, indent=2, ensure_ascii=False, default=json_default),
+        "verified_output": json.dumps(verified_output, indent=2, ensure_ascii=False, default=json_default),
         "post_processing_section": post_processing_section,
+        "image_preprocessing_section": prompt_section(task_info.get("model_io", {}).get("image_spec")),
+        "api_concurrency_section": api_profiler.ui_prompt_section(task_info.get("model_io", {}).get("api_profile")),
+        "api_call_granularity": batching.ui_prompt_section(task_info.get("model_io", {}).get("batch_spec")),
         "data_path": task_info.get("data_path", ""),
         "dataset_description": dataset_desc_str,
         "auxiliary_file_paths": auxiliary_paths_str,
@@ -81,18 +87,32 @@ def run(task_info: dict) -> str | None:
     user_prompt = user_prompt_template.format(**prompt_variables)
 
     # Create LLM processing chain
-    chain = create_llm_chain(system_prompt, model=GENERATOR_MODEL, temperature=0.2)
+    chain = create_llm_chain(system_prompt, temperature=0.2, tier="ui")
 
     try:
         print("--- Sending UI Generation Prompt to LLM ---")
-        generated_code = chain.invoke({"user_prompt": user_prompt})
-        cleaned_code = clean_llm_output(generated_code)
-
         # Generate safe filename
         task_name = task_info.get('task_name', 'unknown_task')
         safe_task_name = re.sub(r'\s+', '_', task_name)
         script_path = os.path.join(GENERATED_CODE_DIR, f"{safe_task_name}_app.py")
 
+        # requests.post chỉ được phép nằm trong các hàm của API handler
+        handler_functions = set(re.findall(r"^def\s+(\w+)\s*\(", task_info.get("api_handler_code") or "", re.MULTILINE))
+        cleaned_code, _ = generate_code(
+            chain, user_prompt,
+            stream_path=f"{script_path}.stream",
+            allowed_post_functions=handler_functions,
+            label="Step 2",
+            cancel_event=cancel_event,
+        )
+
+        # Chèn lớp đo thời gian (preprocess/api_call/postprocess/render) vào app
+        if APP_METRICS_ENABLED:
+            cleaned_code = inject_instrumentation(cleaned_code, safe_task_name)
+
+        # Cho phép chạy app offline/tái lập bằng cassette (theo API_CASSETTE_MODE lúc app khởi động)
+        cleaned_code = inject_install(cleaned_code)
+
         # Save UI code
         with open(script_path, "w", encoding="utf-8") as f:
             f.write(cleaned_code)
@@ -104,6 +124,9 @@ def run(task_info: dict) -> str | None:
 
         print(f"✅ UI layout code generated and saved to {script_path}")
         return script_path
+    except StreamCancelled:
+        print("⏹️ Step 2 cancelled.")
+        return None
     except KeyError as e:
         print(f"❌ Missing key in task_info: {e}")
         return None
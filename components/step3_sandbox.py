@@ -1,39 +1,44 @@
-import os
-import subprocess
-import sys
 import time
-from config import MAX_DEBUG_ATTEMPTS, SANDBOX_TIMEOUT
+from utils.app_supervisor import AppSupervisor
+from config import SANDBOX_TIMEOUT
 
-def run(script_path: str, task_info: dict):
+STATS_INTERVAL = 60
+
+def run(script_path: str, task_info: dict, supervisor: AppSupervisor | None = None):
     print("--- Running Step 3: Streamlit Sandbox Execution ---")
-    
-    for attempt in range(MAX_DEBUG_ATTEMPTS + 1):
-        try:
-            # Launch Streamlit app
-            process = subprocess.Popen(
-                [sys.executable, "-m", "streamlit", "run", script_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            print("✅ Streamlit app launched successfully")
-            print(f"Application is running on http://localhost:8501")
-            
-            # Monitor process
-            try:
-                while True:
-                    time.sleep(10)
-            except KeyboardInterrupt:
-                print("\nStopping application...")
-                process.terminate()
-                break
-                
-        except Exception as e:
-            print(f"❌ Error launching Streamlit app: {e}")
-            if attempt < MAX_DEBUG_ATTEMPTS:
-                # Debugging logic here
-                pass
-            else:
-                print("❌ Max debug attempts reached")
-                return
\ No newline at end of file
+
+    owns_supervisor = supervisor is None
+    supervisor = supervisor or AppSupervisor()
+
+    try:
+        app = supervisor.start(script_path, name=f"{task_info.get('task_name', 'app')}_app")
+    except Exception as e:
+        print(f"❌ Error launching Streamlit app: {e}")
+        return
+
+    task_info["sandbox"] = {"port": app.port, "url": app.url, "log_path": app.log_path}
+
+    if supervisor.wait_until_ready(app, timeout=SANDBOX_TIMEOUT):
+        print("✅ Streamlit app launched successfully")
+    else:
+        print(f"⚠️ Streamlit app did not report healthy within {SANDBOX_TIMEOUT}s. Check log: {app.log_path}")
+    print(f"Application is running on {app.url}")
+    print(f"Logs: {app.log_path}")
+
+    if not owns_supervisor:
+        # Batch/demo: supervisor dùng chung tự theo dõi các app
+        return app
+
+    # Monitor process
+    try:
+        last_report = time.time()
+        while app.status != "failed":
+            time.sleep(10)
+            if time.time() - last_report >= STATS_INTERVAL:
+                supervisor.print_stats()
+                last_report = time.time()
+        print("❌ Max restart attempts reached")
+    except KeyboardInterrupt:
+        print("\nStopping application...")
+    finally:
+        supervisor.stop_all()
@@ -20,6 +20,69 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GENERATOR_MODEL = os.getenv("MODEL")
 DEBUGGER_MODEL = os.getenv("MODEL")
 
+# Backend mặc định cho LLM: "openai" hoặc "local" (server tương thích OpenAI chạy offline)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:8000/v1")
+
+# Định tuyến model theo tầng (tier) cho từng call site:
+# - latency_budget: thời gian mục tiêu (giây), vượt quá sẽ được cảnh báo trong log
+# - timeout: thời gian tối đa (giây) cho một lần gọi; khi stream là deadline cho cả lời gọi
+# - fallback: tier dùng thay thế khi lần gọi bị timeout (kể cả khi đang stream dở)
+# - priority: thứ tự trong hàng đợi của scheduler (số nhỏ được phục vụ trước)
+MODEL_TIERS = {
+    "payload": {
+        "model": os.getenv("PAYLOAD_MODEL", GENERATOR_MODEL),
+        "backend": os.getenv("PAYLOAD_BACKEND", LLM_BACKEND),
+        "latency_budget": 10,
+        "timeout": 30,
+        "fallback": "handler",
+        "priority": 1,
+    },
+    "handler": {
+        "model": os.getenv("HANDLER_MODEL", GENERATOR_MODEL),
+        "backend": os.getenv("HANDLER_BACKEND", LLM_BACKEND),
+        "latency_budget": 45,
+        "timeout": 120,
+        "fallback": "ui",
+        "priority": 2,
+    },
+    "ui": {
+        "model": os.getenv("UI_MODEL", GENERATOR_MODEL),
+        "backend": os.getenv("UI_BACKEND", LLM_BACKEND),
+        "latency_budget": 90,
+        "timeout": 240,
+        "fallback": None,
+        "priority": 2,
+    },
+    "debug": {
+        "model": os.getenv("DEBUG_MODEL", DEBUGGER_MODEL),
+        "backend": os.getenv("DEBUG_BACKEND", LLM_BACKEND),
+        "latency_budget": 60,
+        "timeout": 180,
+        "fallback": "ui",
+        "priority": 0,
+    },
+}
+
+# Scheduler chung cho mọi lời gọi LLM trong tiến trình
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Giới hạn token mỗi phút (ước lượng), 0 = không giới hạn
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# Số token output ước lượng cho mỗi lời gọi khi tính giới hạn token/phút
+LLM_OUTPUT_TOKEN_ESTIMATE = 1500
+# Đặt thư mục này để áp dụng giới hạn trên cho nhiều tiến trình cùng lúc (file lock)
+LLM_SCHEDULER_LOCK_DIR = os.getenv("LLM_SCHEDULER_LOCK_DIR")
+
+# File JSON-lines ghi độ trễ và số token của từng lần gọi LLM theo tier
+LLM_METRICS_LOG = os.path.join(GENERATED_CODE_DIR, "llm_metrics.jsonl")
+
+# Streaming generation cho step1c/step2 (kiểm tra cú pháp tăng dần, huỷ sớm)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+# Số ký tự mới nhận được giữa hai lần kiểm tra prefix
+STREAM_CHECK_INTERVAL = 400
+# Số lần thử lại khi output bị huỷ sớm
+STREAM_MAX_ATTEMPTS = 3
+
 SHARED_CONTEXT = {
     "task_name": "",
     "api_url": "",
@@ -34,6 +97,84 @@ MAX_DEBUG_ATTEMPTS = 3
 # Timeout for sandbox execution in seconds
 SANDBOX_TIMEOUT = 120
 
+# --- BLOB STORE ---
+# Thư mục lưu các giá trị lớn (base64 image, mảng float dài) tách khỏi task_info
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(GENERATED_CODE_DIR, ".blobs"))
+# Chuỗi/mảng có kích thước (bytes) vượt ngưỡng này sẽ được thay bằng tham chiếu
+BLOB_INLINE_THRESHOLD = 4096
+# Tổng dung lượng giữ trong RAM trước khi đẩy xuống đĩa
+BLOB_MEMORY_BUDGET = 16 * 1024 * 1024
+
+# --- IMAGE CODEC ---
+# Mặc định khi task spec/probe không cho biết độ phân giải model dùng
+IMAGE_MAX_SIDE = 1024
+IMAGE_FORMAT = "JPEG"
+IMAGE_QUALITY = 85
+# Số ảnh đã mã hoá được giữ lại theo từng upload
+IMAGE_CACHE_SIZE = 32
+
+# --- PIPELINE DAG ---
+# Chạy trước step1c/step2 từ schema trong lúc step1b còn đang gọi API thật
+PIPELINE_SPECULATIVE = os.getenv("PIPELINE_SPECULATIVE", "true").lower() == "true"
+
+# --- API PROFILING ---
+# Stage tuỳ chọn sau step1b: đo throughput/độ trễ của model API để cấu hình handler.
+# Step1c/step2 cần profile, nên chỉ chạy trước (PIPELINE_SPECULATIVE) được khi đã có
+# profile cache của lần chạy trước cho cùng API URL. Lần đầu với một API không có cache:
+# step1c/step2 chờ cả step1b và step1d, không có chồng lấp nào.
+API_PROFILING_ENABLED = os.getenv("API_PROFILING_ENABLED", "false").lower() == "true"
+API_PROFILE_CONCURRENCY = (1, 2, 4, 8, 16)
+# Số request tối thiểu ở mỗi mức đồng thời
+API_PROFILE_REQUESTS_PER_LEVEL = 8
+# Hệ số kích thước payload (số pixel ảnh, độ dài list/audio/bảng, độ dài text)
+API_PROFILE_SIZE_FACTORS = (0.25, 1, 4)
+# Tổng thời gian tối đa cho profiling (giây)
+API_PROFILE_TIME_BUDGET = 60
+API_PROFILE_DIR = os.path.join(GENERATED_CODE_DIR, "api_profiles")
+
+# --- MICRO-BATCHING ---
+# Sinh handler gom nhiều item vào một request khi API nhận list (vd. `queries`)
+BATCHING_ENABLED = os.getenv("BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_ITEMS = 16
+BATCH_MAX_BYTES = 1 * 1024 * 1024
+
+# --- API CASSETTES ---
+# Ghi/phát lại request tới model API: off | record | replay | auto
+API_CASSETTE_MODE = os.getenv("API_CASSETTE_MODE", "off").lower()
+API_CASSETTE_DIR = os.getenv("API_CASSETTE_DIR", os.path.join(GENERATED_CODE_DIR, "cassettes"))
+# Hệ số nhân độ trễ đã ghi khi phát lại (0 = trả về ngay, 1 = giống lúc ghi)
+API_CASSETTE_LATENCY_SCALE = float(os.getenv("API_CASSETTE_LATENCY_SCALE", "0"))
+
+# --- APP METRICS ---
+# Lớp đo thời gian được chèn vào mọi app được sinh ra
+APP_METRICS_ENABLED = os.getenv("APP_METRICS_ENABLED", "true").lower() == "true"
+APP_METRICS_DIR = os.path.join(GENERATED_CODE_DIR, "metrics")
+# Số interaction gần nhất dùng để tính percentile
+APP_METRICS_WINDOW = 500
+# Chu kỳ ghi lại file Prometheus text (giây)
+APP_METRICS_PROM_INTERVAL = 5
+# Ngân sách overhead của lớp đo cho mỗi interaction (ms); vượt quá thì giảm tần suất ghi JSON-lines
+APP_METRICS_OVERHEAD_BUDGET_MS = 1.0
+
 # Add Streamlit-specific config
 STREAMLIT_PORT = 8501
-STREAMLIT_CONFIG_FILE = os.path.expanduser("~/.streamlit/config.toml")
\ No newline at end of file
+STREAMLIT_CONFIG_FILE = os.path.expanduser("~/.streamlit/config.toml")
+
+# --- SANDBOX SUPERVISOR ---
+# Dải port cấp phát động cho các app được sinh ra
+SANDBOX_PORT_RANGE = (STREAMLIT_PORT, STREAMLIT_PORT + 199)
+# Log stdout/stderr của từng app, xoay vòng theo kích thước
+SANDBOX_LOG_DIR = os.path.join(GENERATED_CODE_DIR, "logs")
+SANDBOX_LOG_MAX_BYTES = 1024 * 1024
+SANDBOX_LOG_BACKUPS = 3
+# Giới hạn tài nguyên cho mỗi app (0 = không giới hạn). Bộ nhớ là RLIMIT_DATA (heap +
+# mmap ẩn danh), không phải RSS hay virtual memory (RLIMIT_AS dễ giết app numpy/torch)
+# CPU-time là tổng cộng dồn: app phục vụ lâu dài sẽ bị giết rồi khởi động lại, nên mặc định
+# tắt; đặt SANDBOX_CPU_SECONDS cho các lần chạy thử ngắn (sandbox test)
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "0"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "4096"))
+# Khởi động lại app bị crash với backoff luỹ thừa (giây)
+SANDBOX_MAX_RESTARTS = 5
+SANDBOX_RESTART_BACKOFF = (1, 60)
+# App chạy ổn định lâu hơn ngưỡng này thì bộ đếm crash liên tiếp được reset
+SANDBOX_STABLE_UPTIME = 60
\ No newline at end of file
@@ -1,8 +1,12 @@
 import argparse
 import os
 from utils import helpers
-from components import step1_parse, step1b_verify_io, step1c_generate_api_handler, step2_generate, step3_sandbox
-from config import DEFAULT_TASK_YAML_PATH
+from utils.llm_router import summarize_metrics
+from utils.llm_scheduler import get_scheduler
+from utils import api_cassette
+from utils.stage_graph import Stage, StageGraph, StageFailed
+from components import step1_parse, step1b_verify_io, step1c_generate_api_handler, step1d_profile_api, step2_generate, step3_sandbox
+from config import DEFAULT_TASK_YAML_PATH, PIPELINE_SPECULATIVE, API_PROFILING_ENABLED
 
 def main():
     """
@@ -27,30 +31,58 @@ def main():
     print(f"STARTING PIPELINE FOR TASK: {args.yaml_path}")
     print(f"=============================================")
     
-    # Step 1a: Parse the specified YAML file
-    task_info = step1_parse.run(args.yaml_path)
-    if not task_info:
-        print("Pipeline failed at Step 1a. Aborting.")
-        return
+    def run_ui(inputs, cancel_event):
+        script_path = step2_generate.run(inputs["handler"], cancel_event=cancel_event)
+        return (inputs["handler"], script_path) if script_path else None
 
-    # Step 1b: Verify the Model I/O with a live API call
-    verified_task_info = step1b_verify_io.run(task_info)
-    if not verified_task_info:
-        print("Pipeline failed at Step 1b. Could not verify a working API request. Aborting.")
-        return
-        
-    # Step 1c: Generate API handler logic
-    task_info_with_handler = step1c_generate_api_handler.run(verified_task_info)
-    if not task_info_with_handler:
-        print("Pipeline failed at Step 1c. Aborting.")
-        return
-    
-    # Step 2: Generate UI layout
-    ui_script_path = step2_generate.run(task_info_with_handler)
-    if not ui_script_path:
-        print("Pipeline failed at Step 2. Aborting.")
+    # Step 1a -> 1b -> (1d) -> 1c -> 2 dưới dạng đồ thị; 1c/2 được chạy trước từ schema khi 1b còn gọi API
+    stages = [
+        Stage("parse", lambda inputs, cancel_event: step1_parse.run(args.yaml_path)),
+        Stage("verify", lambda inputs, cancel_event: step1b_verify_io.run(inputs["parse"]), deps=("parse",),
+              predict=lambda inputs: step1b_verify_io.predict(inputs["parse"]),
+              agrees=step1b_verify_io.prediction_differences),
+    ]
+    handler_dep = "verify"
+    if API_PROFILING_ENABLED:
+        # Profile của lần chạy trước (nếu có) được dự đoán ngay từ I/O dự đoán của step1b, để
+        # step1c/step2 chạy trước trong lúc step1b và step1d còn chạy. Không có cache: không chạy trước.
+        stages.append(Stage("profile", lambda inputs, cancel_event: step1d_profile_api.run(inputs["verify"]), deps=("verify",),
+                            predict=lambda inputs: step1d_profile_api.predict(inputs["verify"]),
+                            agrees=step1d_profile_api.prediction_differences))
+        handler_dep = "profile"
+    stages += [
+        Stage("handler", lambda inputs, cancel_event: step1c_generate_api_handler.run(inputs[handler_dep], cancel_event),
+              deps=(handler_dep,),
+              speculative=True),
+        Stage("ui", run_ui, deps=("handler",), speculative=True),
+    ]
+    graph = StageGraph(stages, speculate=PIPELINE_SPECULATIVE)
+
+    failure_messages = {
+        "parse": "Pipeline failed at Step 1a. Aborting.",
+        "verify": "Pipeline failed at Step 1b. Could not verify a working API request. Aborting.",
+        "profile": "Pipeline failed at Step 1d. Aborting.",
+        "handler": "Pipeline failed at Step 1c. Aborting.",
+        "ui": "Pipeline failed at Step 2. Aborting.",
+    }
+    try:
+        results = graph.run()
+    except StageFailed as e:
+        print(failure_messages[e.stage])
         return
+    graph.print_report()
+
+    task_info_with_handler, ui_script_path = results["ui"]
+    # Kết quả suy đoán mang I/O dự đoán: thay bằng I/O đã xác minh thật
+    task_info_with_handler["model_io"] = results["verify"]["model_io"]
     
+    # Thống kê độ trễ/token theo tier để tinh chỉnh MODEL_TIERS
+    for tier, tier_summary in summarize_metrics().items():
+        print(f"📊 LLM tier '{tier}': {tier_summary}")
+    print(f"📊 LLM scheduler: {get_scheduler().metrics()}")
+    if api_cassette.stats()["mode"] != "off":
+        print(f"📊 API cassettes: {api_cassette.stats()}")
+
     # Step 3: Sandbox testing
     if "verified_input" not in task_info_with_handler.get("model_io", {}):
         print("⚠️ Warning: No verified input available for testing")
@@ -0,0 +1,339 @@
+# utils/api_cassette.py
+"""
+Ghi/phát lại (record/replay) các request HTTP tới model API.
+
+Mỗi endpoint có một file cassette nén (gzip JSON) trong API_CASSETTE_DIR. Các
+cặp request/response được lưu theo hash của payload đã chuẩn hoá (thứ tự key,
+số thực làm tròn), kèm thời gian phản hồi.
+
+Chế độ (API_CASSETTE_MODE):
+    off    -> luôn gọi API thật (mặc định)
+    record -> gọi API thật và ghi/cập nhật cassette
+    replay -> chỉ đọc cassette, không có mạng; thiếu bản ghi thì ném CassetteMiss
+    auto   -> phát lại nếu có, nếu không thì gọi API thật và ghi lại
+
+Khi phát lại, độ trễ đã ghi được cộng thêm theo API_CASSETTE_LATENCY_SCALE
+(0 = trả về ngay). Khi gọi API thật mà cassette đã có bản ghi cho cùng payload,
+cấu trúc response được so sánh với bản ghi và mọi sai khác (drift) được báo ra
+và ghi vào drift.jsonl.
+
+Dùng trực tiếp api_cassette.post(...) thay cho requests.post(...), hoặc gọi
+install() để vá requests.post (step2 chèn sẵn vào app được sinh ra).
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá trong tiến trình
+    fcntl = None
+
+import requests
+
+from config import API_CASSETTE_MODE, API_CASSETTE_DIR, API_CASSETTE_LATENCY_SCALE
+from utils.blob_store import BlobRef, summarize
+
+MODES = ("off", "record", "replay", "auto")
+FLOAT_DIGITS = 6
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Chế độ replay nhưng cassette không có bản ghi cho payload này."""
+
+
+# --- Chuẩn hoá payload và cấu trúc response ---
+def _normalize(obj):
+    if isinstance(obj, BlobRef):
+        return f"blob:{obj.digest}"
+    if isinstance(obj, float):
+        return float(f"{obj:.{FLOAT_DIGITS}g}")
+    if isinstance(obj, dict):
+        return {str(key): _normalize(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(item) for item in obj]
+    return obj
+
+
+def request_key(method: str, url: str, body) -> str:
+    """Hash của method + URL + payload đã chuẩn hoá."""
+    if isinstance(body, (bytes, bytearray)):
+        body_part = hashlib.sha256(body).hexdigest()
+    elif isinstance(body, str):
+        body_part = hashlib.sha256(body.encode("utf-8")).hexdigest()
+    else:
+        body_part = json.dumps(_normalize(body), sort_keys=True, separators=(",", ":"))
+    raw = f"{method.upper()} {url}\n{body_part}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def structure(obj, depth: int = 0):
+    """Khung cấu trúc của JSON: key, kiểu dữ liệu, kiểu phần tử của list (không giữ giá trị)."""
+    if depth > 12:
+        return "..."
+    if isinstance(obj, BlobRef):
+        return ["number"] if obj.kind == "number_array" else "str"
+    if isinstance(obj, dict):
+        return {key: structure(value, depth + 1) for key, value in sorted(obj.items())}
+    if isinstance(obj, list):
+        return [structure(obj[0], depth + 1)] if obj else []
+    if isinstance(obj, bool):
+        return "bool"
+    if isinstance(obj, (int, float)):
+        return "number"
+    if obj is None:
+        return "null"
+    return type(obj).__name__
+
+
+def structure_diff(expected, actual, path: str = "$", strict_empty: bool = False) -> list[str]:
+    """
+    Danh sách các điểm khác nhau giữa hai khung cấu trúc.
+
+    List rỗng không cho biết kiểu phần tử nên mặc định khớp mọi list. Với
+    strict_empty=True (so sánh với dự đoán), list rỗng ở expected là "chưa biết"
+    và khác với list có phần tử ở actual.
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        diffs = [f"{path}.{key}: missing" for key in expected if key not in actual]
+        diffs += [f"{path}.{key}: unexpected" for key in actual if key not in expected]
+        for key in expected.keys() & actual.keys():
+            diffs += structure_diff(expected[key], actual[key], f"{path}.{key}", strict_empty)
+        return diffs
+    if isinstance(expected, list) and isinstance(actual, list):
+        if expected and actual:
+            return structure_diff(expected[0], actual[0], f"{path}[]", strict_empty)
+        if strict_empty and not expected and actual:
+            return [f"{path}[]: unknown -> {_kind(actual[0])}"]
+        return []
+    if expected != actual and "null" not in (expected, actual):
+        return [f"{path}: {_kind(expected)} -> {_kind(actual)}"]
+    return []
+
+
+def _kind(node) -> str:
+    if isinstance(node, dict):
+        return "object"
+    if isinstance(node, list):
+        return "array"
+    return node
+
+
+# --- Cassette ---
+class Cassette:
+    """
+    Các tương tác đã ghi của một endpoint, lưu trong một file gzip JSON.
+
+    Nhiều app (tiến trình) có thể ghi cùng một cassette: mỗi lần ghi giữ flock trên
+    file .lock, đọc lại file, gộp bản ghi mới rồi thay file qua file tạm riêng của tiến trình.
+    """
+
+    def __init__(self, path: str, url: str):
+        self.path = path
+        self.url = url
+        self._lock = threading.Lock()
+        self.interactions = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                return json.load(f).get("interactions", {})
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read cassette {self.path}: {e}")
+            return {}
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            return self.interactions.get(key)
+
+    def put(self, key: str, entry: dict):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Gộp với bản ghi của các tiến trình khác đã ghi sau lần đọc trước
+                self.interactions = {**self.interactions, **self._load(), key: entry}
+                data = {"version": 1, "url": self.url, "interactions": self.interactions}
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+_stats = {"live": 0, "replayed": 0, "recorded": 0, "misses": 0, "drift": 0, "write_errors": 0}
+# App Streamlit gọi API từ nhiều thread cùng lúc
+_stats_lock = threading.Lock()
+_warned_modes = set()
+
+
+def cassette_path(url: str, cassette_dir: str = API_CASSETTE_DIR) -> str:
+    parts = urlsplit(url)
+    name = re.sub(r"[^\w.-]+", "_", f"{parts.netloc}{parts.path}").strip("_") or "api"
+    return os.path.join(cassette_dir, f"{name}.json.gz")
+
+
+def get_cassette(url: str) -> Cassette:
+    path = cassette_path(url)
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path, url)
+        return _cassettes[path]
+
+
+def _to_response(entry: dict, url: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.url = url
+    response.reason = "Replayed"
+    response.headers.update(entry.get("headers", {}))
+    if "json" in entry:
+        response._content = json.dumps(entry["json"]).encode("utf-8")
+    else:
+        response._content = entry.get("text", "").encode("utf-8")
+    response.encoding = "utf-8"
+    response.elapsed = datetime.timedelta(seconds=entry.get("elapsed_s", 0.0))
+    return response
+
+
+def _to_entry(response: requests.Response, body, elapsed: float) -> dict:
+    entry = {
+        "status": response.status_code,
+        "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+        "elapsed_s": round(elapsed, 4),
+        "recorded_at": time.time(),
+        "request": summarize(body) if isinstance(body, (dict, list)) else None,
+    }
+    try:
+        entry["json"] = response.json()
+        entry["structure"] = structure(entry["json"])
+    except ValueError:
+        entry["text"] = response.text
+    return entry
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _report_drift(url: str, key: str, diffs: list[str]):
+    _count("drift")
+    print(f"⚠️ API drift for {url} (payload {key[:12]}): response structure changed")
+    for diff in diffs[:10]:
+        print(f"    {diff}")
+    try:
+        os.makedirs(API_CASSETTE_DIR, exist_ok=True)
+        with open(os.path.join(API_CASSETTE_DIR, "drift.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "url": url, "key": key, "diffs": diffs}) + "\n")
+    except OSError:
+        pass
+
+
+_live_post = requests.post
+
+
+def post(url: str, data=None, json=None, mode: str | None = None, **kwargs) -> requests.Response:
+    """
+    Thay thế requests.post có hỗ trợ cassette.
+
+    Request gửi file (files=) hoặc body không phải JSON/bytes/str luôn đi thẳng tới API.
+    """
+    mode = mode or API_CASSETTE_MODE
+    if mode not in MODES:
+        if mode not in _warned_modes:
+            _warned_modes.add(mode)
+            print(f"⚠️ Unknown API_CASSETTE_MODE '{mode}', expected one of {MODES}. Cassettes disabled.")
+        mode = "off"
+    body = json if json is not None else data
+    if mode == "off" or kwargs.get("files") or not isinstance(body, (dict, list, str, bytes, bytearray)):
+        return _live_post(url, data=data, json=json, **kwargs)
+
+    key = request_key("POST", url, body)
+    cassette = get_cassette(url)
+    recorded = cassette.get(key)
+
+    if recorded is not None and mode in ("replay", "auto"):
+        _count("replayed")
+        if API_CASSETTE_LATENCY_SCALE > 0:
+            time.sleep(recorded.get("elapsed_s", 0.0) * API_CASSETTE_LATENCY_SCALE)
+        return _to_response(recorded, url)
+    if mode == "replay":
+        _count("misses")
+        raise CassetteMiss(f"No cassette entry for POST {url} (payload {key[:12]}) in {cassette.path}")
+
+    start = time.perf_counter()
+    response = _live_post(url, data=data, json=json, **kwargs)
+    _count("live")
+    entry = _to_entry(response, body, time.perf_counter() - start)
+
+    if recorded is not None and "structure" in recorded and "structure" in entry:
+        diffs = structure_diff(recorded["structure"], entry["structure"])
+        if diffs:
+            _report_drift(url, key, diffs)
+    # Chỉ ghi response thành công để replay không tái hiện lỗi tạm thời
+    if response.ok:
+        # Request thật đã thành công: lỗi ghi cassette không được làm hỏng lời gọi
+        try:
+            cassette.put(key, entry)
+            _count("recorded")
+        except (OSError, TypeError, ValueError) as e:
+            _count("write_errors")
+            print(f"⚠️ Could not write cassette {cassette.path}: {e}")
+    return response
+
+
+def install(mode: str | None = None):
+    """Vá requests.post để mọi lời gọi trong tiến trình đi qua cassette (không làm gì khi mode=off)."""
+    mode = mode or API_CASSETTE_MODE
+    if mode not in MODES:
+        print(f"⚠️ Unknown API_CASSETTE_MODE '{mode}', expected one of {MODES}. Cassettes disabled.")
+        return
+    if mode == "off" or getattr(requests.post, "_api_cassette", False):
+        return
+
+    def patched_post(url, data=None, json=None, **kwargs):
+        return post(url, data=data, json=json, mode=mode, **kwargs)
+
+    patched_post._api_cassette = True
+    requests.post = patched_post
+    requests.api.post = patched_post
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, mode=API_CASSETTE_MODE)
+
+
+def inject_install(code: str) -> str:
+    """
+    Chèn install() vào đầu code app được sinh ra (sau các dòng `from __future__`).
+    Luôn chèn: install() đọc API_CASSETTE_MODE lúc app khởi động (mode=off thì không làm gì),
+    nên app sinh ra lúc tắt cassette vẫn ghi/phát lại được sau này. App chạy ngoài repo bỏ qua cassette.
+    """
+    if "_api_cassette.install(" in code:
+        return code
+    header = (
+        "try:\n"
+        "    from utils import api_cassette as _api_cassette\n"
+        "except ImportError:\n"
+        "    pass\n"
+        "else:\n"
+        "    _api_cassette.install()\n"
+    )
+    lines = code.splitlines(keepends=True)
+    insert_at = 0
+    for index, line in enumerate(lines):
+        if line.startswith("from __future__"):
+            insert_at = index + 1
+    return "".join(lines[:insert_at]) + header + "".join(lines[insert_at:])
@@ -0,0 +1,285 @@
+# utils/api_profiler.py
+"""
+Đo năng lực của model API sau khi step1b đã có một payload hợp lệ.
+
+- Quét mức đồng thời (API_PROFILE_CONCURRENCY): throughput, p50/p95/p99 độ trễ,
+  tỉ lệ lỗi, điểm bão hoà (mức mà tăng thêm worker không còn tăng throughput)
+  và rate limiting (HTTP 429 / Retry-After).
+- Quét kích thước payload (API_PROFILE_SIZE_FACTORS): ảnh được đổi độ phân giải,
+  list dài nhất (audio, hàng bảng, chuỗi thời gian) được lặp/cắt, text được lặp.
+- Suy ra cấu hình cho handler được sinh ra: timeout, số lần retry, backoff, số worker.
+
+Profile được lưu trong task_info["model_io"]["api_profile"] và cache theo API URL
+trong API_PROFILE_DIR để lần chạy sau có thể dùng trước (xem pipeline).
+"""
+import base64
+import io
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+from config import (
+    API_PROFILE_CONCURRENCY,
+    API_PROFILE_REQUESTS_PER_LEVEL,
+    API_PROFILE_SIZE_FACTORS,
+    API_PROFILE_TIME_BUDGET,
+    API_PROFILE_DIR,
+)
+from utils import blob_store, image_codec
+
+SATURATION_GAIN = 1.10   # Throughput phải tăng >= 10% mới coi là chưa bão hoà
+MAX_ERROR_RATE = 0.5
+
+# Cấu hình cố định trước khi có profiling (gen_api_handler_prompt.txt cũ)
+DEFAULT_SETTINGS = {"timeout": 30, "max_retries": 3, "backoff": 1.0, "workers": 1}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _send(api_url: str, payload, timeout: float) -> dict:
+    start = time.perf_counter()
+    try:
+        response = requests.post(api_url, json=payload, timeout=timeout)
+        status = response.status_code
+        retry_after = response.headers.get("Retry-After")
+    except requests.Timeout:
+        status, retry_after = "timeout", None
+    except requests.RequestException:
+        status, retry_after = "error", None
+    return {"latency": time.perf_counter() - start, "status": status, "retry_after": retry_after}
+
+
+def _summarize(results: list[dict], elapsed: float) -> dict:
+    ok = [r["latency"] for r in results if r["status"] == 200]
+    summary = {
+        "requests": len(results),
+        "ok": len(ok),
+        "rate_limited": sum(r["status"] == 429 for r in results),
+        "errors": sum(r["status"] != 200 and r["status"] != 429 for r in results),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+    if ok:
+        summary.update({f"p{int(q * 100)}_s": round(_percentile(ok, q), 3) for q in (0.5, 0.95, 0.99)})
+    retry_after = [r["retry_after"] for r in results if r["retry_after"]]
+    if retry_after:
+        summary["retry_after"] = retry_after[0]
+    return summary
+
+
+def sweep_concurrency(api_url: str, payload, levels=API_PROFILE_CONCURRENCY,
+                      requests_per_level: int = API_PROFILE_REQUESTS_PER_LEVEL,
+                      timeout: float = 60, deadline: float | None = None) -> list[dict]:
+    """Gửi payload ở từng mức đồng thời; dừng sớm khi bão hoà, bị rate limit hoặc lỗi nhiều."""
+    report = []
+    best_throughput = 0.0
+    for level in levels:
+        if deadline and time.time() > deadline:
+            print(f"⚠️ Profiling time budget reached before concurrency {level}")
+            break
+        total = max(requests_per_level, level * 2)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            results = list(pool.map(lambda _: _send(api_url, payload, timeout), range(total)))
+        summary = {"concurrency": level, **_summarize(results, time.perf_counter() - start)}
+        report.append(summary)
+        print(f"📊 [profile] concurrency={level}: {summary['throughput_rps']} req/s, "
+              f"p95={summary.get('p95_s', '-')}s, 429={summary['rate_limited']}, errors={summary['errors']}")
+
+        if summary["rate_limited"] or summary["errors"] > total * MAX_ERROR_RATE:
+            break
+        if best_throughput and summary["throughput_rps"] < best_throughput * SATURATION_GAIN:
+            break
+        best_throughput = max(best_throughput, summary["throughput_rps"])
+    return report
+
+
+# --- Thay đổi kích thước payload ---
+def _scale_image(value: str, factor: float) -> str:
+    from PIL import Image
+    prefix, data = value.split(",", 1) if value.startswith("data:") else ("", value)
+    image = Image.open(io.BytesIO(base64.b64decode(data)))
+    size = (max(8, int(image.width * factor)), max(8, int(image.height * factor)))
+    buffer = io.BytesIO()
+    image.convert("RGB").resize(size).save(buffer, format="JPEG", quality=90)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"{prefix},{encoded}" if prefix else encoded
+
+
+def _scale_list(values: list, factor: float) -> list:
+    target = max(1, int(round(len(values) * factor)))
+    return [values[i % len(values)] for i in range(target)]
+
+
+def _largest_leaf(obj, path=()):
+    """(path, giá trị, kích thước) của list hoặc chuỗi lớn nhất trong payload."""
+    if isinstance(obj, dict):
+        best = (None, None, 0)
+        for key, value in obj.items():
+            candidate = _largest_leaf(value, path + (key,))
+            if candidate[2] > best[2]:
+                best = candidate
+        return best
+    if isinstance(obj, str):
+        # Ảnh luôn được ưu tiên quét trước text
+        return (path, obj, len(obj) * (1000 if image_codec.payload_has_image(obj) else 1))
+    if isinstance(obj, list):
+        return (path, obj, len(obj))
+    return (None, None, 0)
+
+
+def scale_payload(payload, factor: float):
+    """Bản sao payload với phần dữ liệu lớn nhất được phóng to/thu nhỏ theo factor."""
+    path, value, _ = _largest_leaf(payload)
+    if not path or value is None:
+        return None
+    if isinstance(value, str) and image_codec.payload_has_image(value):
+        scaled = _scale_image(value, math.sqrt(factor))  # factor theo số pixel
+    elif isinstance(value, list):
+        scaled = _scale_list(value, factor)
+    elif isinstance(value, str):
+        scaled = (value * math.ceil(factor))[:max(1, int(len(value) * factor))]
+    else:
+        return None
+    copy = json.loads(json.dumps(payload))
+    target = copy
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = scaled
+    return copy
+
+
+def sweep_payload_size(api_url: str, payload, factors=API_PROFILE_SIZE_FACTORS,
+                       samples: int = 3, timeout: float = 60, deadline: float | None = None) -> list[dict]:
+    """Độ trễ tuần tự theo kích thước payload (bytes JSON)."""
+    report = []
+    for factor in factors:
+        if deadline and time.time() > deadline:
+            print(f"⚠️ Profiling time budget reached before size factor {factor}")
+            break
+        scaled = payload if factor == 1 else scale_payload(payload, factor)
+        if scaled is None:
+            break
+        results = [_send(api_url, scaled, timeout) for _ in range(samples)]
+        summary = {"factor": factor, "payload_bytes": len(json.dumps(scaled)),
+                   **_summarize(results, sum(r["latency"] for r in results))}
+        report.append(summary)
+        print(f"📊 [profile] size x{factor} ({summary['payload_bytes']} B): p50={summary.get('p50_s', '-')}s, "
+              f"ok={summary['ok']}/{samples}")
+        if not summary["ok"]:
+            break
+    return report
+
+
+def recommend(concurrency: list[dict], sizes: list[dict]) -> dict:
+    """Cấu hình cho handler được sinh ra, suy ra từ kết quả đo."""
+    healthy = [level for level in concurrency if level["ok"] and not level["rate_limited"]]
+    if not healthy:
+        return dict(DEFAULT_SETTINGS)
+
+    best = max(healthy, key=lambda level: level["throughput_rps"])
+    rate_limited = any(level["rate_limited"] for level in concurrency)
+    # p99 ở mức bão hoà, nhân hệ số cho payload lớn nhất đã đo được
+    worst_p99 = max(level.get("p99_s", 0.0) for level in healthy)
+    ok_sizes = [size for size in sizes if size.get("p50_s")]
+    size_ratio = 1.0
+    if ok_sizes:
+        base = next((size["p50_s"] for size in ok_sizes if size["factor"] == 1), ok_sizes[0]["p50_s"])
+        size_ratio = max(size["p50_s"] for size in ok_sizes) / base if base else 1.0
+    timeout = int(min(120, max(5, math.ceil(worst_p99 * max(1.0, size_ratio) * 3))))
+
+    backoff = round(max(0.5, best.get("p50_s", 1.0)), 1)
+    retry_after = next((level["retry_after"] for level in concurrency if level.get("retry_after")), None)
+    if retry_after and str(retry_after).replace(".", "", 1).isdigit():
+        backoff = max(backoff, float(retry_after))
+
+    return {
+        "timeout": timeout,
+        "max_retries": 3 if rate_limited or any(level["errors"] for level in concurrency) else 2,
+        "backoff": backoff,
+        "workers": best["concurrency"],
+        "rate_limited": rate_limited,
+        "max_throughput_rps": best["throughput_rps"],
+    }
+
+
+def profile_endpoint(api_url: str, payload, time_budget: float = API_PROFILE_TIME_BUDGET) -> dict:
+    deadline = time.time() + time_budget
+    payload = blob_store.materialize(payload)
+    concurrency = sweep_concurrency(api_url, payload, deadline=deadline)
+    sizes = sweep_payload_size(api_url, payload, deadline=deadline)
+    settings = recommend(concurrency, sizes)
+    # Điểm bão hoà: throughput ngừng tăng, hoặc mức cao nhất trước khi bị rate limit
+    saturation, limited_by = None, None
+    for previous, level in zip(concurrency, concurrency[1:]):
+        if level["rate_limited"]:
+            saturation, limited_by = settings["workers"], "rate_limit"
+            break
+        if level["throughput_rps"] < previous["throughput_rps"] * SATURATION_GAIN:
+            saturation, limited_by = previous["concurrency"], "throughput"
+            break
+    return {
+        "api_url": api_url,
+        "profiled_at": time.time(),
+        "concurrency": concurrency,
+        "payload_size": sizes,
+        "saturation_concurrency": saturation,
+        "limited_by": limited_by,
+        "settings": settings,
+    }
+
+
+# --- Cache theo API URL ---
+def _cache_path(api_url: str) -> str:
+    parts = urlsplit(api_url)
+    name = re.sub(r"[^\w.-]+", "_", f"{parts.netloc}{parts.path}").strip("_") or "api"
+    return os.path.join(API_PROFILE_DIR, f"{name}.json")
+
+
+def load_cached(api_url: str) -> dict | None:
+    try:
+        with open(_cache_path(api_url), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(profile: dict):
+    os.makedirs(API_PROFILE_DIR, exist_ok=True)
+    with open(_cache_path(profile["api_url"]), "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def prompt_section(profile: dict | None) -> str:
+    """Yêu cầu về timeout/retry/worker cho prompt sinh API handler/UI."""
+    settings = (profile or {}).get("settings") or DEFAULT_SETTINGS
+    if not profile:
+        return f"Use requests.post() with timeout={settings['timeout']}"
+    lines = [
+        f"Use requests.post() with timeout={settings['timeout']} (derived from the measured p99 latency and payload-size sweep)",
+        f"   - Retry up to {settings['max_retries']} times on timeouts, connection errors, HTTP 429 and 5xx, "
+        f"with exponential backoff starting at {settings['backoff']}s; honour the Retry-After header on 429.",
+        f"   - When processing several items, run requests with concurrent.futures.ThreadPoolExecutor("
+        f"max_workers={settings['workers']}); the endpoint saturates beyond {settings['workers']} concurrent requests.",
+    ]
+    if settings.get("rate_limited"):
+        lines.append("   - The endpoint enforces rate limiting: never exceed the worker count above.")
+    return "\n".join(lines)
+
+
+def ui_prompt_section(profile: dict | None) -> str:
+    """Hướng dẫn xử lý nhiều item song song trong UI; rỗng khi chưa có profile."""
+    if not profile or not profile.get("settings"):
+        return ""
+    workers = profile["settings"]["workers"]
+    return (f"- When the user submits several items, call the API handler concurrently with "
+            f"concurrent.futures.ThreadPoolExecutor(max_workers={workers}) and update a progress bar as results arrive "
+            f"(the model API was profiled to saturate beyond {workers} concurrent requests).")
@@ -0,0 +1,299 @@
+# utils/app_metrics.py
+"""
+Lớp đo thời gian chạy cho các app Streamlit được sinh ra.
+
+Step2 chèn lớp này vào mọi *_app.py (inject_instrumentation). Mỗi lần chạy
+main() là một interaction, được tách thành các pha:
+    preprocess  -> từ đầu interaction tới lần gọi API đầu tiên
+    api_call    -> thời gian trong call_model_api/api_handler
+    postprocess -> sau lần gọi API cuối, trừ thời gian render
+    render      -> thời gian trong st.image, st.pyplot, st.dataframe...
+    total       -> toàn bộ interaction
+
+Percentile (p50/p95/p99) được tính trên cửa sổ trượt, xuất ra file JSON-lines
+và file Prometheus text (dạng textfile collector) trong APP_METRICS_DIR.
+Panel debug hiện ở sidebar khi URL có ?debug=1 hoặc đặt APP_METRICS_DEBUG=1.
+"""
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+from config import (
+    APP_METRICS_DIR,
+    APP_METRICS_WINDOW,
+    APP_METRICS_PROM_INTERVAL,
+    APP_METRICS_OVERHEAD_BUDGET_MS,
+)
+
+PHASES = ("preprocess", "api_call", "postprocess", "render", "total", "overhead")
+API_FUNCTIONS = ("call_model_api", "api_handler")
+RENDER_FUNCTIONS = (
+    "image", "pyplot", "plotly_chart", "altair_chart", "vega_lite_chart", "bokeh_chart",
+    "dataframe", "table", "line_chart", "bar_chart", "area_chart", "scatter_chart",
+    "audio", "video", "map",
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class AppMetrics:
+    def __init__(self, app_name: str, metrics_dir: str = APP_METRICS_DIR, window: int = APP_METRICS_WINDOW):
+        self.app_name = app_name
+        self.windows = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.interactions = 0
+        self.jsonl_every = 1
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_prom_write = 0.0
+        os.makedirs(metrics_dir, exist_ok=True)
+        safe_name = re.sub(r"[^\w.-]", "_", app_name)
+        self.jsonl_path = os.path.join(metrics_dir, f"{safe_name}.jsonl")
+        self.prom_path = os.path.join(metrics_dir, f"{safe_name}.prom")
+
+    # --- Thu thập ---
+    def interaction(self, fn):
+        """Bọc main(): mỗi lần chạy là một interaction."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timeline = {"start": time.perf_counter(), "api": [], "render": 0.0,
+                        "render_after_api": 0.0, "in_render": False}
+            self._local.timeline = timeline
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                self._local.timeline = None
+                self._finish(timeline, time.perf_counter())
+            render_debug_panel(self)
+            return result
+        wrapper._app_metrics = True
+        return wrapper
+
+    def instrument_api(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                timeline = getattr(self._local, "timeline", None)
+                if timeline is not None:
+                    timeline["api"].append((start, end))
+                else:
+                    self._record({"api_call": end - start}, 0.0)
+        wrapper._app_metrics = True
+        return wrapper
+
+    def instrument_render(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timeline = getattr(self._local, "timeline", None)
+            if timeline is None or timeline["in_render"]:
+                return fn(*args, **kwargs)
+            timeline["in_render"] = True
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                timeline["render"] += duration
+                if timeline["api"]:
+                    timeline["render_after_api"] += duration
+                timeline["in_render"] = False
+        wrapper._app_metrics = True
+        return wrapper
+
+    def _finish(self, timeline: dict, end: float):
+        overhead_start = time.perf_counter()
+        phases = {"total": end - timeline["start"], "render": timeline["render"]}
+        if timeline["api"]:
+            first_start = timeline["api"][0][0]
+            last_end = timeline["api"][-1][1]
+            render_before_api = timeline["render"] - timeline["render_after_api"]
+            phases["api_call"] = sum(e - s for s, e in timeline["api"])
+            phases["preprocess"] = max(0.0, first_start - timeline["start"] - render_before_api)
+            phases["postprocess"] = max(0.0, end - last_end - timeline["render_after_api"])
+        self._record(phases, overhead_start)
+
+    def _record(self, phases: dict, overhead_start: float):
+        now = time.time()
+        with self._lock:
+            for phase, duration in phases.items():
+                self.windows[phase].append(duration)
+                self.counts[phase] += 1
+                self.sums[phase] += duration
+            self.interactions += 1
+            write_jsonl = self.interactions % self.jsonl_every == 0
+            write_prom = now - self._last_prom_write >= APP_METRICS_PROM_INTERVAL
+            if write_prom:
+                self._last_prom_write = now
+
+        try:
+            if write_jsonl:
+                entry = {"ts": now, "app": self.app_name,
+                         **{f"{phase}_ms": round(d * 1000, 3) for phase, d in phases.items()}}
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            if write_prom:
+                self._write_prometheus()
+        except OSError:
+            pass
+
+        if overhead_start:
+            self._track_overhead(time.perf_counter() - overhead_start)
+
+    def _track_overhead(self, overhead: float):
+        """Giữ overhead dưới ngân sách bằng cách giảm/tăng tần suất ghi JSON-lines."""
+        budget = APP_METRICS_OVERHEAD_BUDGET_MS / 1000
+        with self._lock:
+            window = self.windows["overhead"]
+            window.append(overhead)
+            self.counts["overhead"] += 1
+            self.sums["overhead"] += overhead
+            recent = sorted(list(window)[-50:])
+            median = recent[len(recent) // 2]
+            if median > budget and self.jsonl_every < 64:
+                self.jsonl_every *= 2
+            elif median < budget / 4 and self.jsonl_every > 1:
+                self.jsonl_every //= 2
+
+    # --- Báo cáo ---
+    def percentiles(self) -> dict:
+        with self._lock:
+            snapshot = {phase: sorted(values) for phase, values in self.windows.items() if values}
+        report = {}
+        for phase in PHASES:
+            values = snapshot.get(phase)
+            if not values:
+                continue
+            report[phase] = {f"p{int(q * 100)}": values[min(len(values) - 1, int(q * len(values)))]
+                             for q in QUANTILES}
+            report[phase]["count"] = self.counts[phase]
+        return report
+
+    def _write_prometheus(self):
+        labels = f'app="{self.app_name}"'
+        lines = [
+            "# HELP app_phase_seconds Duration of each interaction phase in the generated app.",
+            "# TYPE app_phase_seconds summary",
+        ]
+        for phase, stats in self.percentiles().items():
+            for q in QUANTILES:
+                lines.append(f'app_phase_seconds{{{labels},phase="{phase}",quantile="{q}"}} '
+                             f'{stats[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'app_phase_seconds_sum{{{labels},phase="{phase}"}} {self.sums[phase]:.6f}')
+            lines.append(f'app_phase_seconds_count{{{labels},phase="{phase}"}} {self.counts[phase]}')
+        tmp_path = f"{self.prom_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+
+_metrics = None
+_install_lock = threading.Lock()
+
+
+def _patch_streamlit(metrics: AppMetrics):
+    import streamlit as st
+    from streamlit.delta_generator import DeltaGenerator
+
+    # st.image... là bound method của main DeltaGenerator, col.image... đi qua class
+    for target in (st, DeltaGenerator):
+        for name in RENDER_FUNCTIONS:
+            original = getattr(target, name, None)
+            if original is not None and not getattr(original, "_app_metrics", False):
+                setattr(target, name, metrics.instrument_render(original))
+
+
+def install(app_name: str) -> AppMetrics:
+    """Khởi tạo (một lần cho mỗi tiến trình) và vá các hàm render của Streamlit."""
+    global _metrics
+    with _install_lock:
+        if _metrics is None:
+            _metrics = AppMetrics(app_name)
+            try:
+                _patch_streamlit(_metrics)
+            except ImportError:
+                pass
+        return _metrics
+
+
+def interaction(fn):
+    return (_metrics or install("app")).interaction(fn)
+
+
+def instrument_api(fn):
+    return (_metrics or install("app")).instrument_api(fn)
+
+
+def render_debug_panel(metrics: AppMetrics):
+    """Bảng percentile theo pha ở sidebar, chỉ hiện khi bật chế độ debug."""
+    # Chỉ dùng khi đang chạy trong app Streamlit, không tự import
+    st = sys.modules.get("streamlit")
+    if st is None:
+        return
+    try:
+        enabled = os.getenv("APP_METRICS_DEBUG") == "1" or st.query_params.get("debug") == "1"
+    except Exception:
+        return
+    if not enabled:
+        return
+    rows = [
+        {"phase": phase, **{key: (value if key == "count" else round(value * 1000, 2))
+                            for key, value in stats.items()}}
+        for phase, stats in metrics.percentiles().items()
+    ]
+    with st.sidebar.expander("⏱️ Performance (ms)", expanded=True):
+        st.table(rows)
+        st.caption(f"{metrics.interactions} interactions · JSON-lines every {metrics.jsonl_every} · "
+                   f"{metrics.prom_path}")
+
+
+_MAIN_GUARD = re.compile(r"""^if\s+__name__\s*==\s*['"]__main__['"]\s*:""", re.MULTILINE)
+
+
+def inject_instrumentation(code: str, app_name: str) -> str:
+    """
+    Chèn lớp đo vào code app: install() ở đầu file, bọc call_model_api/api_handler
+    và main() ngay trước khối `if __name__ == "__main__":`.
+    """
+    if "_app_metrics.install(" in code:
+        return code
+    if not _MAIN_GUARD.search(code):
+        print("⚠️ No `if __name__ == \"__main__\":` block found; skipping app instrumentation.")
+        return code
+
+    # App chạy ngoài repo (streamlit run từ thư mục khác, deploy riêng) không import được
+    # utils/config: bỏ qua lớp đo thay vì làm app lỗi
+    header = (
+        "try:\n"
+        "    from utils import app_metrics as _app_metrics\n"
+        "except ImportError:\n"
+        "    _app_metrics = None\n"
+        "else:\n"
+        f"    _app_metrics.install({app_name!r})\n"
+    )
+    lines = code.splitlines(keepends=True)
+    insert_at = 0
+    # Giữ `from __future__` ở đầu file
+    for index, line in enumerate(lines):
+        if line.startswith("from __future__"):
+            insert_at = index + 1
+    code = "".join(lines[:insert_at]) + header + "".join(lines[insert_at:])
+
+    footer = (
+        f"\nif _app_metrics is not None:\n"
+        f"    for _name in {API_FUNCTIONS!r}:\n"
+        f"        if callable(globals().get(_name)):\n"
+        f"            globals()[_name] = _app_metrics.instrument_api(globals()[_name])\n"
+        f"    if callable(globals().get('main')):\n"
+        f"        main = _app_metrics.interaction(main)\n\n"
+    )
+    match = _MAIN_GUARD.search(code)
+    return code[:match.start()] + footer + code[match.start():]
@@ -0,0 +1,347 @@
+# utils/app_supervisor.py
+"""
+Supervisor cho nhiều app Streamlit được sinh ra chạy cùng lúc trên một máy.
+
+- Cấp phát port động trong SANDBOX_PORT_RANGE; app không bind được port (bị tiến
+  trình khác chiếm giữa lúc kiểm tra và lúc khởi động) được chạy lại ngay trên port mới.
+- Luồng riêng đọc stdout/stderr của mỗi app và ghi ra file log xoay vòng,
+  để pipe không bao giờ bị đầy làm app treo.
+- Giới hạn CPU-time và bộ nhớ heap (rlimit) cho từng app (chỉ trên Unix).
+- Tự khởi động lại app bị crash với backoff luỹ thừa.
+- Báo cáo RSS, CPU và uptime của từng app.
+
+Chạy độc lập cho batch/demo:
+    python -m utils.app_supervisor generated_code/*_app.py
+"""
+import argparse
+import logging
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from logging.handlers import RotatingFileHandler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from config import (
+    SANDBOX_PORT_RANGE,
+    SANDBOX_LOG_DIR,
+    SANDBOX_LOG_MAX_BYTES,
+    SANDBOX_LOG_BACKUPS,
+    SANDBOX_CPU_SECONDS,
+    SANDBOX_MEMORY_MB,
+    SANDBOX_MAX_RESTARTS,
+    SANDBOX_RESTART_BACKOFF,
+    SANDBOX_STABLE_UPTIME,
+    SANDBOX_TIMEOUT,
+)
+
+
+class ManagedApp:
+    def __init__(self, name: str, script_path: str, port: int, log_path: str):
+        self.name = name
+        self.script_path = script_path
+        self.port = port
+        self.log_path = log_path
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.consecutive_crashes = 0
+        self.next_restart_at = None
+        self.status = "starting"  # starting | running | backoff | failed | stopped
+        self.port_conflict = False
+        self.logger = None
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.port}"
+
+
+# Đặt rlimit trong tiến trình con rồi exec lệnh thật. Không dùng preexec_fn: supervisor
+# có nhiều thread (monitor, đọc log, stage DAG) và preexec_fn có thể làm con bị deadlock
+# trước khi exec. Bộ nhớ dùng RLIMIT_DATA (heap + mmap ẩn danh) thay vì RLIMIT_AS: AS tính
+# cả vùng địa chỉ chỉ được đặt trước (thread stack, numpy/torch/CUDA) nên giết app dù RSS nhỏ.
+_RLIMIT_WRAPPER = """
+import os, resource, sys
+cpu_seconds, memory_mb = int(sys.argv[1]), int(sys.argv[2])
+if cpu_seconds:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+if memory_mb:
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+os.execv(sys.argv[3], sys.argv[3:])
+"""
+
+
+def _limit_resources(command: list, cpu_seconds: int, memory_mb: int) -> list:
+    """Bọc command để tiến trình con tự đặt rlimit CPU/bộ nhớ trước khi exec."""
+    if resource is None or not (cpu_seconds or memory_mb):
+        return command
+    return [sys.executable, "-c", _RLIMIT_WRAPPER, str(cpu_seconds), str(memory_mb), *command]
+
+
+def _process_stats(pid: int) -> dict:
+    """RSS (MB) và CPU-time (giây) của tiến trình, qua psutil hoặc /proc."""
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            cpu = proc.cpu_times()
+            return {"rss_mb": proc.memory_info().rss / 2**20, "cpu_s": cpu.user + cpu.system}
+        except psutil.Error:
+            return {}
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    # utime, stime là trường thứ 14, 15 của /proc/<pid>/stat
+    cpu_s = (int(fields[11]) + int(fields[12])) / ticks
+    return {"rss_mb": rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, "cpu_s": cpu_s}
+
+
+class AppSupervisor:
+    def __init__(self, port_range: tuple = SANDBOX_PORT_RANGE, log_dir: str = SANDBOX_LOG_DIR,
+                 cpu_seconds: int = SANDBOX_CPU_SECONDS, memory_mb: int = SANDBOX_MEMORY_MB,
+                 max_restarts: int = SANDBOX_MAX_RESTARTS, backoff: tuple = SANDBOX_RESTART_BACKOFF):
+        self.port_range = port_range
+        self.log_dir = log_dir
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.apps = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._monitor = threading.Thread(target=self._monitor_loop, name="app-supervisor", daemon=True)
+        self._monitor.start()
+
+    # --- Cấp phát port ---
+    @staticmethod
+    def _port_is_free(port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(("0.0.0.0", port))
+            except OSError:
+                return False
+        return True
+
+    def _allocate_port(self) -> int:
+        used = {app.port for app in self.apps.values() if app.status not in ("stopped", "failed")}
+        for port in range(self.port_range[0], self.port_range[1] + 1):
+            if port not in used and self._port_is_free(port):
+                return port
+        raise RuntimeError(f"No free port in range {self.port_range}")
+
+    # --- Vòng đời app ---
+    def start(self, script_path: str, name: str | None = None) -> ManagedApp:
+        name = name or os.path.splitext(os.path.basename(script_path))[0]
+        name = re.sub(r"[^\w.-]", "_", name)
+        with self._lock:
+            if name in self.apps and self.apps[name].status not in ("stopped", "failed"):
+                return self.apps[name]
+            os.makedirs(self.log_dir, exist_ok=True)
+            app = ManagedApp(name, os.path.abspath(script_path), self._allocate_port(),
+                             os.path.join(self.log_dir, f"{name}.log"))
+            app.logger = self._make_logger(app)
+            self.apps[name] = app
+            self._spawn(app)
+        return app
+
+    def _make_logger(self, app: ManagedApp) -> logging.Logger:
+        logger = logging.getLogger(f"sandbox.{app.name}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        handler = RotatingFileHandler(app.log_path, maxBytes=SANDBOX_LOG_MAX_BYTES,
+                                      backupCount=SANDBOX_LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        return logger
+
+    def _spawn(self, app: ManagedApp):
+        command = [
+            sys.executable, "-m", "streamlit", "run", app.script_path,
+            "--server.port", str(app.port),
+            "--server.headless", "true",
+        ]
+        # App được sinh ra import các module dùng chung (vd. utils.image_codec) từ thư mục repo
+        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        python_path = os.pathsep.join(filter(None, [repo_root, os.environ.get("PYTHONPATH")]))
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONPATH=python_path)
+        app.process = subprocess.Popen(
+            _limit_resources(command, self.cpu_seconds, self.memory_mb),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
+            env=env,
+        )
+        app.started_at = time.time()
+        app.next_restart_at = None
+        app.status = "running"
+        app.logger.info(f"[supervisor] started pid={app.process.pid} port={app.port}")
+        threading.Thread(target=self._pump_logs, args=(app, app.process),
+                         name=f"logs-{app.name}", daemon=True).start()
+
+    @staticmethod
+    def _pump_logs(app: ManagedApp, process: subprocess.Popen):
+        for line in iter(process.stdout.readline, ""):
+            lowered = line.lower()
+            if str(app.port) in line and ("is not available" in lowered or "already in use" in lowered):
+                app.port_conflict = True
+            app.logger.info(line.rstrip("\n"))
+        process.stdout.close()
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(1.0):
+            now = time.time()
+            with self._lock:
+                for app in self.apps.values():
+                    if app.status == "running" and app.process.poll() is not None:
+                        self._handle_exit(app, now)
+                    elif app.status == "backoff" and now >= app.next_restart_at:
+                        app.restarts += 1
+                        if not self._port_is_free(app.port):
+                            self._move_port(app)
+                        self._spawn(app)
+
+    def _move_port(self, app: ManagedApp):
+        old_port = app.port
+        app.port = self._allocate_port()
+        app.logger.info(f"[supervisor] port {old_port} is taken, moving to {app.port}")
+        print(f"⚠️ App '{app.name}': port {old_port} is taken, moving to {app.url}")
+
+    def _handle_exit(self, app: ManagedApp, now: float):
+        returncode = app.process.returncode
+        if app.port_conflict:
+            # Không phải crash của app: chạy lại ngay trên port khác
+            app.port_conflict = False
+            app.logger.info(f"[supervisor] exited with code {returncode} (port {app.port} in use)")
+            app.restarts += 1
+            self._move_port(app)
+            self._spawn(app)
+            return
+        if now - app.started_at >= SANDBOX_STABLE_UPTIME:
+            app.consecutive_crashes = 0
+        app.consecutive_crashes += 1
+        app.logger.info(f"[supervisor] exited with code {returncode}")
+
+        if app.consecutive_crashes > self.max_restarts:
+            app.status = "failed"
+            print(f"❌ App '{app.name}' crashed {app.consecutive_crashes} times in a row, giving up. Log: {app.log_path}")
+            return
+        delay = min(self.backoff[0] * 2 ** (app.consecutive_crashes - 1), self.backoff[1])
+        app.status = "backoff"
+        app.next_restart_at = now + delay
+        print(f"⚠️ App '{app.name}' exited with code {returncode}, restarting in {delay:.1f}s. Log: {app.log_path}")
+
+    def wait_until_ready(self, app: ManagedApp, timeout: float = SANDBOX_TIMEOUT) -> bool:
+        """Chờ endpoint health của Streamlit trả về 200."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if app.status == "failed":
+                return False
+            try:
+                with urllib.request.urlopen(f"{app.url}/_stcore/health", timeout=2) as response:
+                    if response.status == 200:
+                        return True
+            except OSError:
+                pass
+            time.sleep(0.5)
+        return False
+
+    def _terminate(self, app: ManagedApp):
+        if app.process and app.process.poll() is None:
+            app.process.terminate()
+            try:
+                app.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                app.process.kill()
+                app.process.wait()
+        app.status = "stopped"
+        app.logger.info("[supervisor] stopped")
+
+    def stop(self, name: str):
+        with self._lock:
+            app = self.apps.get(name)
+            if app:
+                self._terminate(app)
+
+    def stop_all(self):
+        self._stop_event.set()
+        with self._lock:
+            for app in self.apps.values():
+                self._terminate(app)
+
+    # --- Báo cáo ---
+    def stats(self) -> list[dict]:
+        report = []
+        now = time.time()
+        with self._lock:
+            apps = list(self.apps.values())
+        for app in apps:
+            alive = app.process is not None and app.process.poll() is None
+            entry = {
+                "name": app.name,
+                "status": app.status,
+                "port": app.port,
+                "pid": app.process.pid if alive else None,
+                "uptime_s": round(now - app.started_at) if alive else 0,
+                "restarts": app.restarts,
+            }
+            if alive:
+                entry.update({key: round(value, 1) for key, value in _process_stats(app.process.pid).items()})
+            report.append(entry)
+        return report
+
+    def print_stats(self):
+        for entry in self.stats():
+            print(f"  {entry['name']:<40} {entry['status']:<8} :{entry['port']:<5} "
+                  f"rss={entry.get('rss_mb', '-')}MB cpu={entry.get('cpu_s', '-')}s "
+                  f"uptime={entry['uptime_s']}s restarts={entry['restarts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many generated Streamlit apps on one machine.")
+    parser.add_argument("scripts", nargs="+", help="Paths to generated *_app.py scripts.")
+    parser.add_argument("--report-interval", type=int, default=30, help="Seconds between status reports.")
+    parser.add_argument("--cpu-seconds", type=int, default=SANDBOX_CPU_SECONDS,
+                        help="CPU-time limit per app process (0 = unlimited).")
+    parser.add_argument("--memory-mb", type=int, default=SANDBOX_MEMORY_MB,
+                        help="Heap limit per app process in MB (0 = unlimited).")
+    args = parser.parse_args()
+
+    supervisor = AppSupervisor(cpu_seconds=args.cpu_seconds, memory_mb=args.memory_mb)
+    for script_path in args.scripts:
+        app = supervisor.start(script_path)
+        print(f"▶️ {app.name}: {app.url} (log: {app.log_path})")
+
+    try:
+        while True:
+            time.sleep(args.report_interval)
+            supervisor.print_stats()
+    except KeyboardInterrupt:
+        print("\nStopping all applications...")
+        supervisor.stop_all()
+
+
+if __name__ == "__main__":
+    main()
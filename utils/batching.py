@@ -0,0 +1,273 @@
+# utils/batching.py
+"""
+Micro-batching cho model API nhận danh sách item trong một request.
+
+- detect_batch_spec(): dựa trên schema và I/O đã xác minh ở step1b, tìm field
+  list trong input mà schema mô tả là danh sách item (vd. `queries`) và list trong
+  output chứa một kết quả cho mỗi item (vd. `answers`). Cùng độ dài với sample thì
+  chưa đủ (2 query vs toạ độ [x, y]): output phải được schema mô tả là theo từng
+  item, hoặc được xác nhận bằng một request probe với số item khác. Không chắc
+  chắn thì không batch (vd. time-series `table.data`, `field_names`).
+- MicroBatcher: gom item thành các batch giới hạn theo số item và số byte,
+  gửi song song, tách kết quả theo item và báo tiến độ khi từng batch xong.
+  Batch lỗi được gửi lại từng item một để một item hỏng không làm hỏng cả batch.
+
+App được sinh ra dùng MicroBatcher qua hàm process_items() trong API handler.
+"""
+import copy
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import BATCH_MAX_ITEMS, BATCH_MAX_BYTES
+from utils import blob_store, api_cassette
+
+# Tên/mô tả field input cho thấy đây là danh sách item độc lập (không dùng kiểu "list")
+BATCH_HINTS = ("batch", "multiple", "queries", "questions", "inputs", "texts", "sentences",
+               "prompts", "documents", "items")
+# Mô tả field output cho thấy có một kết quả cho mỗi item input
+PER_ITEM_HINTS = ("each", "per ", "for every", "corresponding", "one result", "in the same order")
+TABLE_KEYS = {"columns", "data"}
+
+
+def _get(obj, path):
+    for key in path:
+        obj = obj[key]
+    return obj
+
+
+def _list_fields(obj, path=()):
+    """Mọi (path, list) trong obj, không đi vào bên trong list."""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _list_fields(value, path + (key,))
+    elif isinstance(obj, list):
+        yield path, obj
+
+
+def _schema_field(input_format: dict, path: tuple) -> dict:
+    field = (input_format or {}).get("structure") or {}
+    for key in path:
+        if not isinstance(field, dict):
+            return {}
+        field = field.get(key) or (field.get("structure") or {}).get(key) or {}
+    return field if isinstance(field, dict) else {}
+
+
+def _is_item_list(values: list) -> bool:
+    """List các item độc lập (text, object, ảnh), không phải vector số (audio) hay hàng bảng."""
+    if len(values) < 2:
+        return False
+    first = values[0]
+    if isinstance(first, (int, float)) or isinstance(first, list):
+        return False
+    return all(type(value) is type(first) for value in values)
+
+
+def _described_per_item(output_format: dict | None, output_path: tuple) -> bool:
+    if not output_path:
+        return False
+    field = _schema_field(output_format, output_path)
+    return any(hint in str(field.get("description", "")).lower() for hint in PER_ITEM_HINTS)
+
+
+def _probe_lengths(probe, verified_input: dict, input_path: tuple, values: list) -> dict | None:
+    """Gửi thêm một item và trả về {output path: độ dài list}; None nếu probe lỗi."""
+    payload = copy.deepcopy(verified_input)
+    _get(payload, input_path[:-1])[input_path[-1]] = list(values) + [values[0]]
+    try:
+        response = probe(payload)
+    except Exception as e:
+        print(f"⚠️ Batch probe for {'.'.join(map(str, input_path))} failed, using output schema only: {e}")
+        return None
+    return {path: len(outputs) for path, outputs in _list_fields(response)}
+
+
+def cassette_probe(api_url: str, timeout: float = 30):
+    """probe(payload) cho detect_batch_spec: một request thật qua cassette (step1b và step1c dùng chung)."""
+    def probe(payload):
+        response = api_cassette.post(api_url, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    return probe
+
+
+def detect_batch_spec(input_format: dict, verified_input, verified_output, profile: dict | None = None,
+                      output_format: dict | None = None, probe=None) -> dict | None:
+    """
+    Trả về {"input_path", "output_path", "max_items", "max_bytes", "workers"} nếu API nhận
+    nhiều item trong một request và trả về kết quả theo thứ tự cho từng item.
+
+    probe(payload) -> response JSON (tuỳ chọn) gửi một request thật với số item khác để
+    xác nhận list output đổi độ dài theo input. Không có probe thì list output phải được
+    output_format mô tả là theo từng item.
+    """
+    verified_input = blob_store.materialize(verified_input)
+    verified_output = blob_store.materialize(verified_output)
+    if not isinstance(verified_input, dict):
+        return None
+
+    found = []
+    for input_path, values in _list_fields(verified_input):
+        if not _is_item_list(values):
+            continue
+        # Cột/hàng của một bảng (`table.columns`, `table.data`) là bố cục, không phải item
+        if len(input_path) > 1 and TABLE_KEYS & set(_get(verified_input, input_path[:-1])):
+            continue
+        field = _schema_field(input_format, input_path)
+        hint_text = f"{'.'.join(map(str, input_path))} {field.get('description', '')}".lower()
+        # Schema phải cho thấy đây là danh sách item (vd. "queries: questions about the table")
+        if not any(hint in hint_text for hint in BATCH_HINTS):
+            continue
+        candidates = [output_path for output_path, outputs in _list_fields(verified_output)
+                      if len(outputs) == len(values)]
+        if not candidates:
+            continue
+        lengths = _probe_lengths(probe, verified_input, input_path, values) if probe is not None else None
+        if lengths is not None:
+            candidates = [path for path in candidates if lengths.get(path) == len(values) + 1]
+        described = [path for path in candidates if _described_per_item(output_format, path)]
+        if lengths is None or len(candidates) > 1:
+            candidates = described
+        if len(candidates) == 1:
+            found.append((input_path, candidates[0]))
+        elif candidates:
+            print(f"⚠️ Ambiguous batch output for {'.'.join(map(str, input_path))}: {candidates}; not batching")
+    if len(found) != 1:
+        return None
+    input_path, output_path = found[0]
+    return with_profile({"input_path": list(input_path), "output_path": list(output_path)}, profile)
+
+
+def with_profile(spec: dict | None, profile: dict | None) -> dict | None:
+    """Giới hạn kích thước batch và số worker của spec đã phát hiện theo kết quả profiling (step1d)."""
+    if not spec:
+        return None
+    max_bytes = BATCH_MAX_BYTES
+    if profile:
+        # Chỉ giới hạn khi profiling thấy payload bị từ chối: dưới kích thước lỗi nhỏ nhất.
+        # Payload lớn nhất đo thành công chỉ là điểm dừng của sweep, không phải giới hạn của API
+        failed = [size["payload_bytes"] for size in profile.get("payload_size", []) if not size.get("ok")]
+        if failed:
+            max_bytes = min(max_bytes, min(failed) - 1)
+    return {
+        "input_path": list(spec["input_path"]),
+        "output_path": list(spec["output_path"]),
+        "max_items": BATCH_MAX_ITEMS,
+        "max_bytes": max_bytes,
+        "workers": ((profile or {}).get("settings") or {}).get("workers", 1),
+    }
+
+
+def make_batches(items: list, max_items: int, max_bytes: int, base_bytes: int = 0) -> list[list[int]]:
+    """Chia chỉ số item thành các batch theo số item và kích thước JSON ước lượng."""
+    batches, current, current_bytes = [], [], base_bytes
+    for index, item in enumerate(items):
+        item_bytes = len(json.dumps(item, default=str)) + 2
+        if current and (len(current) >= max_items or current_bytes + item_bytes > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], base_bytes
+        current.append(index)
+        current_bytes += item_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+
+class MicroBatcher:
+    """
+    Gửi nhiều item qua ít request hơn.
+
+    Args:
+        send (callable): nhận payload (dict), trả về response JSON đã parse.
+        template (dict): payload mẫu; list tại input_path được thay bằng các item của batch.
+        spec (dict): kết quả detect_batch_spec (input_path, output_path, max_items, max_bytes, workers).
+    """
+
+    def __init__(self, send, template: dict, spec: dict):
+        self.send = send
+        self.template = template
+        self.input_path = spec["input_path"]
+        self.output_path = spec["output_path"]
+        self.max_items = max(1, spec.get("max_items", BATCH_MAX_ITEMS))
+        self.max_bytes = spec.get("max_bytes", BATCH_MAX_BYTES)
+        self.workers = max(1, spec.get("workers", 1))
+
+    def _payload(self, batch_items: list) -> dict:
+        payload = copy.deepcopy(self.template)
+        _get(payload, self.input_path[:-1])[self.input_path[-1]] = batch_items
+        return payload
+
+    def _call(self, batch_items: list) -> list:
+        outputs = _get(self.send(self._payload(batch_items)), self.output_path)
+        if not isinstance(outputs, list) or len(outputs) != len(batch_items):
+            raise ValueError(f"Expected {len(batch_items)} results at {self.output_path}, "
+                             f"got {len(outputs) if isinstance(outputs, list) else type(outputs).__name__}")
+        return outputs
+
+    def _call_with_fallback(self, batch_items: list) -> list:
+        try:
+            return self._call(batch_items)
+        except Exception as e:
+            if len(batch_items) == 1:
+                return [e]
+            # Gửi lại từng item: lỗi chỉ ảnh hưởng item hỏng
+            results = []
+            for item in batch_items:
+                try:
+                    results.extend(self._call([item]))
+                except Exception as item_error:
+                    results.append(item_error)
+            return results
+
+    def iter_results(self, items: list):
+        """Sinh (index, kết quả hoặc Exception) theo từng batch hoàn thành."""
+        base_bytes = len(json.dumps(self._payload([]), default=str))
+        batches = make_batches(items, self.max_items, self.max_bytes, base_bytes)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._call_with_fallback, [items[i] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                for index, result in zip(futures[future], future.result()):
+                    yield index, result
+
+    def map(self, items: list, on_progress=None) -> list:
+        """Kết quả theo đúng thứ tự items; on_progress(done, total) được gọi khi mỗi batch trả về."""
+        results = [None] * len(items)
+        done = 0
+        for index, result in self.iter_results(items):
+            results[index] = result
+            done += 1
+            if on_progress:
+                on_progress(done, len(items))
+        return results
+
+
+def prompt_section(spec: dict | None) -> str:
+    """Hướng dẫn sinh handler micro-batching cho prompt step1c; rỗng nếu API không nhận batch."""
+    if not spec:
+        return ""
+    spec_literal = json.dumps(spec)
+    input_field = ".".join(map(str, spec["input_path"]))
+    output_field = ".".join(map(str, spec["output_path"])) or "<response root>"
+    return f"""Micro-batching (REQUIRED, the API accepts several items per request):
+- The list at `{input_field}` holds independent items; the response list at `{output_field}` has one result per item, in order.
+- Besides the single-item function, define `process_items(items, on_progress=None)` that returns one post-processed result per item (or an Exception for a failed item), using:
+  try:
+      from utils.batching import MicroBatcher
+  except ImportError:  # app running outside the project root
+      MicroBatcher = None
+  BATCH_SPEC = {spec_literal}
+  batcher = MicroBatcher(send_payload, template_payload, BATCH_SPEC)
+  raw_results = batcher.map(items, on_progress=on_progress)
+  where `send_payload(payload)` posts one payload and returns the parsed JSON (raising on HTTP errors), and `template_payload` is the payload with all other fields filled in.
+- If MicroBatcher is None, fall back to calling the single-item function for each item in turn (catching exceptions per item and calling on_progress after each).
+- Apply the same post-processing to each per-item result as the single-item path."""
+
+
+def ui_prompt_section(spec: dict | None) -> str:
+    """Quy tắc gọi API cho prompt sinh UI."""
+    if not spec:
+        return "- Send only one data item per API call."
+    return ("- Single inputs go through the single-item API function.\n"
+            "- Add a bulk-input mode (e.g. a CSV upload with one item per row, or multiple file upload) that calls "
+            "`process_items(items, on_progress=...)` from the API handler; show st.progress updated from on_progress "
+            "and render results as they become available, marking failed items (Exception results) with st.warning.")
@@ -0,0 +1,272 @@
+# utils/blob_store.py
+"""
+Kho lưu trữ ngoài (out-of-band) cho các giá trị lớn đi qua task_info.
+
+Chuỗi base64 và mảng số dài được thay bằng BlobRef (tham chiếu theo nội dung,
+sha256). Dữ liệu thật nằm trong RAM tới khi vượt BLOB_MEMORY_BUDGET, sau đó được
+đẩy xuống đĩa và đọc lại qua mmap/memoryview khi thật sự cần.
+
+Mỗi tiến trình ghi vào thư mục con riêng (BLOB_STORE_DIR/<pid>), được xoá khi
+tiến trình thoát; thư mục của tiến trình đã chết được dọn khi tạo store mới.
+"""
+import array
+import atexit
+import hashlib
+import mmap
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from config import BLOB_STORE_DIR, BLOB_INLINE_THRESHOLD, BLOB_MEMORY_BUDGET
+
+IMAGE_PREFIXES = (
+    "iVBOR",   # PNG
+    "/9j/",    # JPEG
+    "R0lGOD",  # GIF
+    "UklGR",   # WebP
+    "PHN2Zy",  # SVG
+    "SUkq"     # TIFF
+)
+
+
+def _human_size(num_bytes: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f}{unit}" if unit == "B" else f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}GB"
+
+
+class BlobRef:
+    """Tham chiếu tới một giá trị lớn trong BlobStore."""
+    __slots__ = ("digest", "kind", "size", "length", "typecode")
+
+    def __init__(self, digest: str, kind: str, size: int, length: int, typecode: str = ""):
+        self.digest = digest
+        self.kind = kind          # "base64_image" | "text" | "number_array"
+        self.size = size          # số byte lưu trữ
+        self.length = length      # số ký tự hoặc số phần tử
+        self.typecode = typecode  # mã kiểu của array.array cho number_array
+
+    def placeholder(self) -> str:
+        """Chuỗi ngắn dùng trong log và prompt thay cho dữ liệu thật."""
+        if self.kind == "number_array":
+            return f"<BLOB:{self.kind}[{self.length}]:{self.digest[:12]}>"
+        return f"<BLOB:{self.kind}:{_human_size(self.size)}:{self.digest[:12]}>"
+
+    def view(self) -> memoryview:
+        return get_store().view(self)
+
+    def value(self):
+        return get_store().load(self)
+
+    def __repr__(self):
+        return self.placeholder()
+
+    __str__ = __repr__
+
+    def __eq__(self, other):
+        return isinstance(other, BlobRef) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+
+class BlobStore:
+    """Kho content-addressed: giữ blob trong RAM, tràn xuống đĩa khi vượt ngân sách."""
+
+    def __init__(self, root: str = BLOB_STORE_DIR, memory_budget: int = BLOB_MEMORY_BUDGET):
+        self.base_dir = root
+        self.root = os.path.join(root, str(os.getpid()))
+        self.memory_budget = memory_budget
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._mapped = {}  # digest -> mmap, dùng chung cho mọi view() của blob đó
+        self._lock = threading.Lock()
+        _remove_stale_dirs(root)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes, kind: str, length: int, typecode: str = "") -> BlobRef:
+        digest = hashlib.sha256(data).hexdigest()
+        ref = BlobRef(digest, kind, len(data), length, typecode)
+        with self._lock:
+            if digest in self._memory or digest in self._mapped or os.path.exists(self._path(digest)):
+                return ref
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+            self._spill_locked()
+        return ref
+
+    def _spill_locked(self):
+        # Đẩy các blob cũ nhất xuống đĩa cho tới khi về dưới ngân sách RAM
+        while self._memory_bytes > self.memory_budget and self._memory:
+            digest, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+            self._write(digest, data)
+
+    def _write(self, digest: str, data: bytes):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def view(self, ref: BlobRef) -> memoryview:
+        """Trả về memoryview tới dữ liệu (không sao chép: RAM hoặc mmap)."""
+        with self._lock:
+            data = self._memory.get(ref.digest)
+        if data is not None:
+            return memoryview(data)
+
+        path = self._path(ref.digest)
+        if not os.path.exists(path):
+            raise KeyError(f"Blob {ref.digest[:12]} not found in {self.root}")
+        if ref.size == 0:
+            return memoryview(b"")
+        with self._lock:
+            mapped = self._mapped.get(ref.digest)
+            if mapped is None:
+                with open(path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped[ref.digest] = mapped
+        return memoryview(mapped)
+
+    def load(self, ref: BlobRef):
+        """Dựng lại giá trị Python gốc (str hoặc list số) từ blob."""
+        with self.view(ref) as view:
+            if ref.kind == "number_array":
+                with view.cast(ref.typecode) as numbers:
+                    return numbers.tolist()
+            return str(view, "utf-8")
+
+    def close(self, remove_files: bool = True):
+        """Đóng các mmap và xoá thư mục blob của tiến trình này."""
+        with self._lock:
+            for mapped in self._mapped.values():
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # Vẫn còn memoryview đang dùng; hệ điều hành giải phóng khi thoát
+            self._mapped.clear()
+            if remove_files:
+                shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _remove_stale_dirs(base_dir: str):
+    """Xoá thư mục blob của các tiến trình không còn chạy."""
+    try:
+        entries = os.listdir(base_dir)
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            os.kill(int(entry), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(base_dir, entry), ignore_errors=True)
+        except OSError:
+            pass  # Tiến trình tồn tại nhưng của user khác
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+            atexit.register(_store.close)
+        return _store
+
+
+def _classify_string(value: str) -> str:
+    stripped = value.lstrip()
+    if (stripped.startswith("data:image") and "base64," in stripped[:100]) or stripped.startswith(IMAGE_PREFIXES):
+        return "base64_image"
+    return "text"
+
+
+def _number_typecode(values: list) -> str | None:
+    """
+    'q' nếu toàn số nguyên, 'd' nếu toàn số thực, None nếu không phải mảng số.
+    List trộn int/float không được đóng gói: int sẽ thành float khi đọc lại.
+    """
+    kinds = set()
+    for item in values:
+        if isinstance(item, bool) or not isinstance(item, (int, float)):
+            return None
+        kinds.add(type(item) is float)
+        if len(kinds) > 1:
+            return None
+    return "d" if True in kinds else "q"
+
+
+def _is_large(value, threshold: int) -> bool:
+    if isinstance(value, str):
+        return len(value) > threshold
+    if isinstance(value, list):
+        # Ước lượng 8 byte mỗi phần tử số
+        return len(value) * 8 > threshold and _number_typecode(value) is not None
+    return False
+
+
+def externalize(obj, threshold: int = BLOB_INLINE_THRESHOLD):
+    """Thay đệ quy các lá lớn bằng BlobRef. Trả về cấu trúc mới, không sửa obj."""
+    if isinstance(obj, BlobRef):
+        return obj
+    if isinstance(obj, str):
+        if len(obj) <= threshold:
+            return obj
+        return get_store().put(obj.encode("utf-8"), _classify_string(obj), len(obj))
+    if isinstance(obj, list):
+        if _is_large(obj, threshold):
+            typecode = _number_typecode(obj)
+            try:
+                data = array.array(typecode, obj).tobytes()
+            except OverflowError:
+                return [externalize(item, threshold) for item in obj]
+            return get_store().put(data, "number_array", len(obj), typecode)
+        return [externalize(item, threshold) for item in obj]
+    if isinstance(obj, dict):
+        return {key: externalize(value, threshold) for key, value in obj.items()}
+    return obj
+
+
+def materialize(obj):
+    """Thay đệ quy mọi BlobRef bằng giá trị thật (dùng ngay trước khi gửi API)."""
+    if isinstance(obj, BlobRef):
+        return obj.value()
+    if isinstance(obj, list):
+        return [materialize(item) for item in obj]
+    if isinstance(obj, dict):
+        return {key: materialize(value) for key, value in obj.items()}
+    return obj
+
+
+def summarize(obj, threshold: int = BLOB_INLINE_THRESHOLD):
+    """Bản rút gọn để in log: lá lớn hiển thị dạng tham chiếu ngắn, không lưu vào kho."""
+    if isinstance(obj, BlobRef):
+        return obj.placeholder()
+    if _is_large(obj, threshold):
+        if isinstance(obj, str):
+            return f"<{_classify_string(obj)}:{_human_size(len(obj))}>"
+        return f"<number_array[{len(obj)}]>"
+    if isinstance(obj, list):
+        return [summarize(item, threshold) for item in obj]
+    if isinstance(obj, dict):
+        return {key: summarize(value, threshold) for key, value in obj.items()}
+    return obj
+
+
+def json_default(obj):
+    """Dùng với json.dumps(default=...) để BlobRef được ghi thành chuỗi tham chiếu."""
+    if isinstance(obj, BlobRef):
+        return obj.placeholder()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
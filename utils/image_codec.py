@@ -0,0 +1,359 @@
+# utils/image_codec.py
+"""
+Codec ảnh dùng chung cho step1b và các app được sinh ra.
+
+- Xác định độ phân giải/định dạng đích từ task spec hoặc từ output đã verify
+  (kích thước depth map/mask cho biết độ phân giải model thực sự dùng).
+- Thu nhỏ và nén lại ảnh trước khi mã hoá base64, cache theo từng upload.
+- Ánh xạ toạ độ trả về (box, keypoint, mask) về độ phân giải ảnh gốc.
+"""
+import base64
+import hashlib
+import io
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils.blob_store import BlobRef, IMAGE_PREFIXES
+from config import IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_CACHE_SIZE
+
+BOX_KEYS = {"box", "boxes", "bbox", "bboxes", "bounding_box", "bounding_boxes"}
+POINT_KEYS = {"keypoints", "points", "landmarks", "polygon", "polygons", "coordinates"}
+X_KEYS = {"x", "x1", "x2", "xmin", "xmax", "left", "right", "cx", "width", "w"}
+Y_KEYS = {"y", "y1", "y2", "ymin", "ymax", "top", "bottom", "cy", "height", "h"}
+# Output của một số model nhỏ hơn input (stride), nên không thu nhỏ dưới ngưỡng này theo probe
+PROBE_MIN_SIDE = 384
+
+
+def default_spec() -> dict:
+    return {"max_side": IMAGE_MAX_SIDE, "format": IMAGE_FORMAT, "quality": IMAGE_QUALITY, "source": "default"}
+
+
+def spec_from_task(input_format: dict) -> dict | None:
+    """Đọc độ phân giải/định dạng đích nếu task spec có ghi (vd. '512x512', '384 px', 'PNG')."""
+    text = json.dumps(input_format or {}, ensure_ascii=False, default=str)
+    spec = {}
+    match = re.search(r"(\d{2,5})\s*[x×]\s*(\d{2,5})", text)
+    if match:
+        spec["max_side"] = max(int(match.group(1)), int(match.group(2)))
+    else:
+        match = re.search(r"(\d{2,5})\s*(?:px|pixels)\b", text, re.IGNORECASE)
+        if match:
+            spec["max_side"] = int(match.group(1))
+    # Chỉ ép định dạng khi spec nêu đúng một định dạng ("JPEG or PNG" thì giữ mặc định)
+    named = {name for name, pattern in (("PNG", r"\bpng\b"), ("JPEG", r"\bjpe?g\b"), ("WEBP", r"\bwebp\b"))
+             if re.search(pattern, text, re.IGNORECASE)}
+    if len(named) == 1:
+        spec["format"] = named.pop()
+    if not spec:
+        return None
+    return {**default_spec(), **spec, "source": "task_spec"}
+
+
+def _array_shape(value) -> tuple | None:
+    """(rows, cols) của mảng số 2 chiều, hỗ trợ hàng đã được đưa vào blob store."""
+    if not isinstance(value, list) or len(value) < 16:
+        return None
+    first = value[0]
+    if getattr(first, "kind", None) == "number_array":
+        return len(value), first.length
+    if isinstance(first, list) and len(first) >= 16 and isinstance(first[0], (int, float)):
+        return len(value), len(first)
+    return None
+
+
+def spec_from_output(verified_output) -> dict | None:
+    """Probe từ response đã verify: map 2D lớn nhất (depth/mask) cho biết độ phân giải model."""
+    best = None
+    stack = [verified_output]
+    while stack:
+        value = stack.pop()
+        shape = _array_shape(value)
+        if shape:
+            best = max(best or (0, 0), shape, key=lambda s: s[0] * s[1])
+            continue
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value[:64])
+    if not best:
+        return None
+    return {**default_spec(), "max_side": max(max(best), PROBE_MIN_SIDE), "source": "probe"}
+
+
+def resolve_spec(input_format: dict | None = None, verified_output=None) -> dict:
+    """Ưu tiên task spec, sau đó probe từ output, cuối cùng là mặc định trong config."""
+    return spec_from_task(input_format) or spec_from_output(verified_output) or default_spec()
+
+
+class PreparedImage:
+    """Ảnh đã thu nhỏ/nén, kèm tỉ lệ để ánh xạ toạ độ về ảnh gốc."""
+
+    def __init__(self, data: bytes, image_format: str, original_size: tuple, size: tuple):
+        self.data = data
+        self.format = image_format
+        self.original_size = original_size
+        self.size = size
+        self.scale_x = original_size[0] / size[0]
+        self.scale_y = original_size[1] / size[1]
+        self._b64 = None
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode("ascii")
+        return self._b64
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def to_original(self, x: float, y: float) -> tuple:
+        return x * self.scale_x, y * self.scale_y
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _read_source(source) -> tuple:
+    """Trả về (raw bytes hoặc None, PIL.Image) cho bytes, file upload, đường dẫn hoặc PIL.Image."""
+    if isinstance(source, Image.Image):
+        return None, source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        raw = bytes(source)
+    elif isinstance(source, str):
+        with open(source, "rb") as f:
+            raw = f.read()
+    elif hasattr(source, "getvalue"):
+        raw = source.getvalue()
+    else:
+        raw = source.read()
+    return raw, Image.open(io.BytesIO(raw))
+
+
+def prepare_image(source, spec: dict | None = None) -> PreparedImage:
+    """
+    Thu nhỏ (không phóng to) và nén ảnh theo spec trước khi gửi API.
+
+    Args:
+        source: bytes, file upload của Streamlit, đường dẫn hoặc PIL.Image.
+        spec (dict | None): {"max_side", "format", "quality"}; mặc định lấy từ config.
+
+    Returns:
+        PreparedImage với .b64 để đưa vào payload và .to_original() để ánh xạ toạ độ.
+    """
+    spec = {**default_spec(), **(spec or {})}
+    raw, image = _read_source(source)
+    digest = hashlib.sha1(raw if raw is not None else image.tobytes()).hexdigest()
+    cache_key = (digest, spec["max_side"], spec["format"], spec["quality"])
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+
+    source_format = (image.format or "").upper()
+    image = ImageOps.exif_transpose(image)
+    original_size = image.size
+    target_format = spec["format"].upper()
+
+    if max(original_size) > spec["max_side"]:
+        image = image.copy()
+        image.thumbnail((spec["max_side"], spec["max_side"]), Image.LANCZOS)
+
+    if raw is not None and image.size == original_size and source_format == target_format:
+        # Đã đúng kích thước và định dạng: gửi nguyên bản, không nén lại
+        data = raw
+    else:
+        if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        save_kwargs = {"quality": spec["quality"], "optimize": True} if target_format in ("JPEG", "WEBP") else {"optimize": True}
+        image.save(buffer, format=target_format, **save_kwargs)
+        data = buffer.getvalue()
+
+    prepared = PreparedImage(data, target_format, original_size, image.size)
+    with _cache_lock:
+        _cache[cache_key] = prepared
+        while len(_cache) > IMAGE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prepared
+
+
+def _is_base64_image_string(value) -> bool:
+    if not isinstance(value, str) or len(value) <= 200:
+        return False
+    stripped = value.lstrip()
+    return (stripped.startswith("data:image") and "base64," in stripped[:100]) or stripped.startswith(IMAGE_PREFIXES)
+
+
+def payload_has_image(payload) -> bool:
+    """True nếu payload (có thể chứa BlobRef) có ảnh base64."""
+    if isinstance(payload, BlobRef):
+        return payload.kind == "base64_image"
+    if isinstance(payload, dict):
+        return any(payload_has_image(value) for value in payload.values())
+    if isinstance(payload, list):
+        return any(payload_has_image(item) for item in payload)
+    return _is_base64_image_string(payload)
+
+
+def prepare_payload_images(payload, spec: dict | None = None):
+    """Thu nhỏ/nén lại mọi ảnh base64 trong payload theo spec (giữ tiền tố data URI nếu có)."""
+    if isinstance(payload, dict):
+        return {key: prepare_payload_images(value, spec) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [prepare_payload_images(item, spec) for item in payload]
+    if not _is_base64_image_string(payload):
+        return payload
+
+    header, _, body = payload.strip().rpartition("base64,")
+    try:
+        prepared = prepare_image(base64.b64decode(body), spec)
+    except (OSError, ValueError):
+        # Định dạng PIL không đọc được (vd. SVG): gửi nguyên bản
+        return payload
+    if header:
+        return f"data:image/{prepared.format.lower()};base64,{prepared.b64}"
+    return prepared.b64
+
+
+def _is_normalized(values: list) -> bool:
+    return all(isinstance(v, (int, float)) and 0.0 <= v <= 1.0 for v in values)
+
+
+def _scale_coords(values: list, prepared: PreparedImage, stride: int, limit: int | None = None) -> list:
+    """Nhân các cặp (x, y) ở vị trí 0, 1 của mỗi nhóm `stride` phần tử trong `limit` phần tử đầu."""
+    limit = len(values) if limit is None else min(limit, len(values))
+    coords = [v for i, v in enumerate(values[:limit]) if i % stride < 2]
+    if _is_normalized(coords):
+        return values
+    scaled = list(values)
+    for i, v in enumerate(values[:limit]):
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            if i % stride == 0:
+                scaled[i] = v * prepared.scale_x
+            elif i % stride == 1:
+                scaled[i] = v * prepared.scale_y
+    return scaled
+
+
+def _is_number_list(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+
+
+def _map_boxes(value, prepared):
+    if _is_number_list(value):
+        # [x1, y1, x2, y2, score, class, ...]: chỉ 4 giá trị đầu là toạ độ
+        return _scale_coords(value, prepared, 2, limit=4)
+    if isinstance(value, list):
+        return [_map_boxes(item, prepared) for item in value]
+    return map_to_original(value, prepared)
+
+
+def _looks_like_triplets(values: list) -> bool:
+    """(x, y, v) kiểu COCO: mọi giá trị thứ ba là cờ visibility (0/1/2) hoặc score trong [0, 1]."""
+    flags = values[2::3]
+    return len(values) % 3 == 0 and all(v in (0, 1, 2) or 0.0 <= v <= 1.0 for v in flags)
+
+
+def _map_points(value, prepared, stride: int = 2):
+    """
+    stride=3 cho keypoints kiểu COCO (x, y, v, ...) khi giá trị thứ ba đúng là cờ/score;
+    polygon/points và keypoints dạng cặp phẳng là các cặp (x, y).
+    """
+    if _is_number_list(value):
+        if len(value) == 3:
+            # Một điểm (x, y, v/score/z), không thể là polygon
+            return _scale_coords(value, prepared, 3)
+        if stride == 3 and _looks_like_triplets(value):
+            return _scale_coords(value, prepared, 3)
+        return _scale_coords(value, prepared, 2)
+    if isinstance(value, list):
+        return [_map_points(item, prepared, stride) for item in value]
+    return map_to_original(value, prepared)
+
+
+def map_to_original(result, prepared: PreparedImage):
+    """
+    Ánh xạ toạ độ trong response (box, keypoint, x/y/width/height) về ảnh gốc.
+    Toạ độ đã chuẩn hoá về [0, 1] được giữ nguyên. Với mask/depth dùng mask_to_original.
+    """
+    if prepared.scale_x == 1 and prepared.scale_y == 1:
+        return result
+    if isinstance(result, list):
+        return [map_to_original(item, prepared) for item in result]
+    if not isinstance(result, dict):
+        return result
+
+    mapped = {}
+    for key, value in result.items():
+        name = str(key).lower()
+        if name in BOX_KEYS:
+            mapped[key] = _map_boxes(value, prepared)
+        elif name in POINT_KEYS:
+            mapped[key] = _map_points(value, prepared, 3 if name == "keypoints" else 2)
+        elif name in X_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool) and value > 1:
+            mapped[key] = value * prepared.scale_x
+        elif name in Y_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool) and value > 1:
+            mapped[key] = value * prepared.scale_y
+        else:
+            mapped[key] = map_to_original(value, prepared)
+    return mapped
+
+
+def mask_to_original(mask, prepared: PreparedImage) -> Image.Image:
+    """
+    Phóng mask/depth map 2D về kích thước ảnh gốc để overlay.
+    Mask nhãn nguyên dùng NEAREST, giá trị thực (depth, xác suất) dùng BILINEAR.
+    """
+    if np is not None:
+        array = np.asarray(mask)
+        if array.dtype == bool:
+            image = Image.fromarray(array.astype(np.uint8) * 255)
+            resample = Image.NEAREST
+        elif np.issubdtype(array.dtype, np.integer):
+            image = Image.fromarray(array.astype(np.int32))
+            resample = Image.NEAREST
+        else:
+            image = Image.fromarray(array.astype(np.float32))
+            resample = Image.BILINEAR
+    else:
+        rows = len(mask)
+        cols = len(mask[0]) if rows else 0
+        flat = [v for row in mask for v in row]
+        is_int = all(isinstance(v, int) for v in flat)
+        image = Image.new("I" if is_int else "F", (cols, rows))
+        image.putdata(flat)
+        resample = Image.NEAREST if is_int else Image.BILINEAR
+    return image.resize(prepared.original_size, resample)
+
+
+def prompt_section(spec: dict | None) -> str:
+    """Hướng dẫn dùng codec cho prompt sinh API handler/UI; rỗng nếu không phải tác vụ ảnh."""
+    if not spec:
+        return ""
+    spec_literal = json.dumps({key: spec[key] for key in ("max_side", "format", "quality")})
+    return f"""Image Preprocessing (shared codec, REQUIRED for image inputs):
+- Do not base64-encode uploaded images yourself. Import the codec with a guard (utils is only importable when the app runs from the project root):
+  try:
+      from utils.image_codec import prepare_image, map_to_original, mask_to_original
+  except ImportError:
+      prepare_image = None
+  IMAGE_SPEC = {spec_literal}
+  prepared = prepare_image(uploaded_file_or_pil_image, IMAGE_SPEC)
+  and send prepared.b64 in the payload field for the image.
+- If prepare_image is None, send base64 of the uploaded bytes unchanged and use the response coordinates and masks as they are (no mapping needed since the image was not resized).
+- prepare_image downscales to the model's resolution, recompresses and caches per upload.
+- Map coordinates in the response back to the original image with map_to_original(result, prepared).
+- For masks or depth maps use mask_to_original(mask, prepared), which returns a PIL image at the original size.
+- Draw overlays on the original image (prepared.original_size), not the downscaled one."""
@@ -1,25 +1,48 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from config import OPENAI_API_KEY
+from utils.llm_router import build_llm
+from utils.llm_scheduler import ScheduledRunnable, get_scheduler
+from config import MODEL_TIERS
 
-def create_llm_chain(system_prompt: str, model: str, temperature: float):
+def create_llm_chain(system_prompt: str, model: str | None = None, temperature: float = 0.2, tier: str = "ui"):
     """
-    Creates a standardized LangChain chain with a specified system prompt, model, and temperature.
+    Creates a standardized LangChain chain with a specified system prompt, model tier, and temperature.
 
     Args:
         system_prompt (str): The system prompt to define the LLM's role.
-        model (str): The name of the OpenAI model to use.
+        model (str | None): Overrides the model configured for the tier.
         temperature (float): The creativity/randomness of the model's output.
+        tier (str): Call-site tier in config.MODEL_TIERS ("payload", "handler", "ui", "debug").
+            Selects model, backend, latency budget, timeout, fallback tier and scheduler priority.
 
     Returns:
-        A LangChain runnable sequence.
+        A LangChain runnable sequence, scheduled through the process-wide LLMScheduler.
     """
-    llm = ChatOpenAI(model=model, temperature=temperature, api_key=OPENAI_API_KEY)
-    
+    # Chain cho từng tier dự phòng: stream chỉ chuyển tier được ở utils.streaming
+    # (with_fallbacks chỉ chuyển trước chunk đầu tiên)
+    tiers = [tier]
+    next_tier = MODEL_TIERS.get(tier, {}).get("fallback")  # Tier sai: build_llm báo lỗi
+    while next_tier and next_tier not in tiers:
+        tiers.append(next_tier)
+        next_tier = MODEL_TIERS[next_tier].get("fallback")
+
     prompt_template = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
         ("human", "{user_prompt}")
     ])
-    
-    return prompt_template | llm | StrOutputParser()
\ No newline at end of file
+
+    chain = None
+    for index in reversed(range(len(tiers))):
+        chain_tier = tiers[index]
+        chain_model = model if index == 0 else None
+        llm = build_llm(chain_tier, temperature, chain_model)
+        chain = ScheduledRunnable(
+            prompt_template | llm | StrOutputParser(),
+            get_scheduler(),
+            tier=chain_tier,
+            priority=MODEL_TIERS[chain_tier].get("priority", 0),
+            key_parts=(system_prompt, chain_model, temperature),
+            timeout=MODEL_TIERS[chain_tier].get("timeout"),
+            fallback=chain,
+        )
+    return chain
@@ -0,0 +1,191 @@
+# utils/llm_router.py
+"""
+Định tuyến lời gọi LLM theo tier (payload, handler, ui, debug).
+
+Mỗi tier có model, backend, ngân sách độ trễ, timeout và tier dự phòng khi
+timeout (xem MODEL_TIERS trong config). Độ trễ và số token của mỗi lần gọi
+được in ra và ghi vào LLM_METRICS_LOG để tinh chỉnh bảng định tuyến.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import openai
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI
+
+from config import OPENAI_API_KEY, LOCAL_LLM_BASE_URL, MODEL_TIERS, LLM_METRICS_LOG
+
+TIMEOUT_EXCEPTIONS = (openai.APITimeoutError, TimeoutError)
+
+
+class LLMBackend:
+    """Giao diện backend: tạo chat model cho một tier."""
+
+    def build(self, model: str, temperature: float, timeout: float | None, callbacks: list):
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    def build(self, model, temperature, timeout, callbacks):
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            api_key=OPENAI_API_KEY,
+            timeout=timeout,
+            max_retries=0,
+            stream_usage=True,
+            callbacks=callbacks,
+        )
+
+
+class LocalBackend(LLMBackend):
+    """Server tương thích OpenAI chạy cục bộ (vLLM, llama.cpp, Ollama...) cho chạy offline."""
+
+    def __init__(self, base_url: str = LOCAL_LLM_BASE_URL):
+        self.base_url = base_url
+
+    def build(self, model, temperature, timeout, callbacks):
+        return ChatOpenAI(
+            model=model or "local-model",
+            temperature=temperature,
+            api_key=OPENAI_API_KEY or "local",
+            base_url=self.base_url,
+            timeout=timeout,
+            max_retries=0,
+            callbacks=callbacks,
+        )
+
+
+BACKENDS = {
+    "openai": OpenAIBackend(),
+    "local": LocalBackend(),
+}
+
+
+def register_backend(name: str, backend: LLMBackend):
+    """Đăng ký backend mới (ví dụ model giả lập cho test offline)."""
+    BACKENDS[name] = backend
+
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+class TierMetricsHandler(BaseCallbackHandler):
+    """Callback đo độ trễ và số token cho mỗi lần gọi model của một tier."""
+
+    def __init__(self, tier: str, model: str, latency_budget: float | None):
+        self.tier = tier
+        self.model = model
+        self.latency_budget = latency_budget
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if getattr(message, "usage_metadata", None):
+                    usage = message.usage_metadata
+        if not usage and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            usage = {
+                "input_tokens": token_usage.get("prompt_tokens", 0),
+                "output_tokens": token_usage.get("completion_tokens", 0),
+            }
+        self._record(run_id, "ok", usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        status = "timeout" if isinstance(error, TIMEOUT_EXCEPTIONS) else "error"
+        self._record(run_id, status, 0, 0)
+
+    def _record(self, run_id, status: str, input_tokens: int, output_tokens: int):
+        start = self._starts.pop(run_id, None)
+        latency = time.perf_counter() - start if start is not None else 0.0
+        entry = {
+            "time": time.time(),
+            "tier": self.tier,
+            "model": self.model,
+            "status": status,
+            "latency_s": round(latency, 3),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+        }
+        over_budget = self.latency_budget is not None and latency > self.latency_budget
+        marker = "⚠️" if status != "ok" or over_budget else "📊"
+        print(f"{marker} [LLM:{self.tier}] {self.model} {status} in {latency:.2f}s"
+              f"{f' (budget {self.latency_budget}s)' if over_budget else ''} | "
+              f"tokens in/out: {input_tokens}/{output_tokens}")
+        with _metrics_lock:
+            _metrics.append(entry)
+            try:
+                os.makedirs(os.path.dirname(LLM_METRICS_LOG) or ".", exist_ok=True)
+                with open(LLM_METRICS_LOG, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError:
+                pass
+
+
+def _build_tier_llm(tier: str, temperature: float, model: str | None = None):
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown model tier '{tier}'. Available: {list(MODEL_TIERS)}")
+    tier_config = MODEL_TIERS[tier]
+    backend_name = tier_config.get("backend", "openai")
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend_name}' for tier '{tier}'. Available: {list(BACKENDS)}")
+
+    model_name = model or tier_config.get("model")
+    handler = TierMetricsHandler(tier, model_name, tier_config.get("latency_budget"))
+    return BACKENDS[backend_name].build(model_name, temperature, tier_config.get("timeout"), [handler])
+
+
+def build_llm(tier: str, temperature: float, model: str | None = None):
+    """
+    Tạo chat model cho tier, nối chuỗi tier dự phòng khi bị timeout.
+
+    Args:
+        tier (str): Tên tier trong MODEL_TIERS.
+        temperature (float): Nhiệt độ sinh.
+        model (str | None): Ghi đè model của tier chính (không áp dụng cho tier dự phòng).
+    """
+    llm = _build_tier_llm(tier, temperature, model)
+
+    fallbacks = []
+    seen = {tier}
+    next_tier = MODEL_TIERS[tier].get("fallback")
+    while next_tier and next_tier not in seen:
+        seen.add(next_tier)
+        fallbacks.append(_build_tier_llm(next_tier, temperature))
+        next_tier = MODEL_TIERS[next_tier].get("fallback")
+
+    if not fallbacks:
+        return llm
+    return llm.with_fallbacks(fallbacks, exceptions_to_handle=TIMEOUT_EXCEPTIONS)
+
+
+def summarize_metrics() -> dict:
+    """Tổng hợp số lần gọi, độ trễ trung bình/lớn nhất và token theo tier trong tiến trình hiện tại."""
+    summary = defaultdict(lambda: {"calls": 0, "timeouts": 0, "latency_total_s": 0.0,
+                                   "latency_max_s": 0.0, "input_tokens": 0, "output_tokens": 0})
+    with _metrics_lock:
+        entries = list(_metrics)
+    for entry in entries:
+        tier_summary = summary[entry["tier"]]
+        tier_summary["calls"] += 1
+        tier_summary["timeouts"] += entry["status"] == "timeout"
+        tier_summary["latency_total_s"] += entry["latency_s"]
+        tier_summary["latency_max_s"] = max(tier_summary["latency_max_s"], entry["latency_s"])
+        tier_summary["input_tokens"] += entry["input_tokens"]
+        tier_summary["output_tokens"] += entry["output_tokens"]
+    for tier_summary in summary.values():
+        tier_summary["latency_avg_s"] = round(tier_summary.pop("latency_total_s") / tier_summary["calls"], 3)
+    return dict(summary)
@@ -0,0 +1,272 @@
+# utils/llm_scheduler.py
+"""
+Scheduler chung cho mọi chain tạo bởi create_llm_chain.
+
+- Giới hạn số lời gọi đồng thời và số token/phút trong tiến trình; khi đặt
+  LLM_SCHEDULER_LOCK_DIR thì giới hạn được chia sẻ giữa các tiến trình qua file lock.
+- Hàng đợi ưu tiên theo tier (priority trong MODEL_TIERS): lời gọi debug được
+  phục vụ trước lời gọi sinh code hàng loạt.
+- Các lời gọi invoke giống hệt nhau đang chạy cùng lúc chỉ gửi một request.
+- Thời gian chờ trong hàng đợi được ghi lại (xem metrics()).
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.runnables import Runnable
+
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_OUTPUT_TOKEN_ESTIMATE,
+    LLM_SCHEDULER_LOCK_DIR,
+)
+
+# Số lần chờ gần nhất giữ lại để tính p95
+WAIT_WINDOW = 1000
+TPM_WINDOW_S = 60.0
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _CrossProcessLimiter:
+    """Giới hạn đồng thời và token/phút giữa các tiến trình bằng fcntl.flock."""
+
+    def __init__(self, lock_dir: str, max_concurrency: int, tokens_per_minute: int):
+        import fcntl  # Chỉ có trên Unix
+        self._fcntl = fcntl
+        self.lock_dir = lock_dir
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def acquire(self, estimated_tokens: int):
+        if self.tokens_per_minute:
+            self._reserve_tokens(estimated_tokens)
+        while True:
+            for index in range(self.max_concurrency):
+                handle = open(os.path.join(self.lock_dir, f"slot_{index}.lock"), "a")
+                try:
+                    self._fcntl.flock(handle, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                    return handle
+                except OSError:
+                    handle.close()
+            time.sleep(0.1)
+
+    def release(self, handle):
+        self._fcntl.flock(handle, self._fcntl.LOCK_UN)
+        handle.close()
+
+    def _reserve_tokens(self, estimated_tokens: int):
+        ledger_path = os.path.join(self.lock_dir, "tpm.ledger")
+        while True:
+            with open(ledger_path, "a+") as ledger:
+                self._fcntl.flock(ledger, self._fcntl.LOCK_EX)
+                ledger.seek(0)
+                now = time.time()
+                entries = []
+                for line in ledger.read().splitlines():
+                    timestamp, tokens = line.split()
+                    if now - float(timestamp) < TPM_WINDOW_S:
+                        entries.append((float(timestamp), int(tokens)))
+                used = sum(tokens for _, tokens in entries)
+                if not entries or used + estimated_tokens <= self.tokens_per_minute:
+                    entries.append((now, estimated_tokens))
+                    ledger.seek(0)
+                    ledger.truncate()
+                    ledger.write("".join(f"{ts} {tokens}\n" for ts, tokens in entries))
+                    return
+                retry_after = entries[0][0] + TPM_WINDOW_S - now
+            time.sleep(max(0.05, min(retry_after, 1.0)))
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 lock_dir: str | None = LLM_SCHEDULER_LOCK_DIR):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._token_window = deque()
+        self._inflight = {}
+        # p95 tính trên cửa sổ gần nhất; số lượng, tổng và max là cộng dồn
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._dedup_hits = 0
+        self._cross_process = (
+            _CrossProcessLimiter(lock_dir, self.max_concurrency, tokens_per_minute) if lock_dir else None
+        )
+
+    def _prune_tokens(self, now: float):
+        while self._token_window and now - self._token_window[0][0] >= TPM_WINDOW_S:
+            self._token_window.popleft()
+
+    def _tokens_available(self, estimated_tokens: int) -> bool:
+        if not self.tokens_per_minute:
+            return True
+        self._prune_tokens(time.time())
+        used = sum(tokens for _, tokens in self._token_window)
+        # Cửa sổ trống thì luôn cho qua, tránh kẹt vĩnh viễn với request lớn hơn giới hạn
+        return not self._token_window or used + estimated_tokens <= self.tokens_per_minute
+
+    def _retry_after(self) -> float | None:
+        if not self.tokens_per_minute or not self._token_window:
+            return None
+        return max(0.05, self._token_window[0][0] + TPM_WINDOW_S - time.time())
+
+    @contextmanager
+    def slot(self, priority: int, estimated_tokens: int, label: str = ""):
+        """Chờ tới lượt (theo priority, rồi FIFO) và giữ một slot trong suốt lời gọi."""
+        start = time.perf_counter()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while not (self._waiting[0] == ticket
+                           and self._active < self.max_concurrency
+                           and self._tokens_available(estimated_tokens)):
+                    self._cond.wait(timeout=self._retry_after())
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._active += 1
+            if self.tokens_per_minute:
+                self._token_window.append((time.time(), estimated_tokens))
+            # Người kế tiếp trong hàng có thể cũng được vào ngay
+            self._cond.notify_all()
+
+        handle = None
+        try:
+            if self._cross_process:
+                handle = self._cross_process.acquire(estimated_tokens)
+            wait = time.perf_counter() - start
+            with self._cond:
+                self._waits.append(wait)
+                self._wait_count += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            if wait >= 1.0:
+                print(f"⏳ [LLM:{label}] waited {wait:.2f}s in scheduler queue")
+            yield
+        finally:
+            if handle is not None:
+                self._cross_process.release(handle)
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def run_deduplicated(self, key: str, fn):
+        """Chạy fn một lần cho mọi lời gọi cùng key đang chờ kết quả đồng thời."""
+        with self._cond:
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[key] = _InFlight()
+            else:
+                self._dedup_hits += 1
+
+        if not leader:
+            inflight.event.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result
+
+        try:
+            inflight.result = fn()
+            return inflight.result
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+            inflight.event.set()
+
+    def metrics(self) -> dict:
+        """Số request, số lần dùng chung kết quả và thời gian chờ trong hàng đợi."""
+        with self._cond:
+            waits = sorted(self._waits)
+            metrics = {
+                "requests": self._wait_count,
+                "dedup_hits": self._dedup_hits,
+                "active": self._active,
+                "queued": len(self._waiting),
+            }
+            if self._wait_count:
+                metrics["queue_wait_avg_s"] = round(self._wait_total / self._wait_count, 3)
+                metrics["queue_wait_max_s"] = round(self._wait_max, 3)
+        if waits:
+            metrics["queue_wait_p95_s"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3)
+        return metrics
+
+
+class ScheduledRunnable(Runnable):
+    """
+    Bọc một chain để mọi invoke/stream đi qua LLMScheduler.
+
+    timeout (thời gian tối đa cho cả lời gọi) và fallback (chain của tier dự phòng)
+    được utils.streaming dùng để áp deadline cho stream và chuyển tier khi quá hạn.
+    """
+
+    def __init__(self, inner: Runnable, scheduler: LLMScheduler, tier: str, priority: int, key_parts: tuple,
+                 timeout: float | None = None, fallback: "ScheduledRunnable | None" = None):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.tier = tier
+        self.priority = priority
+        self.key_parts = key_parts
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def _key(self, input) -> str:
+        raw = json.dumps([self.tier, *self.key_parts, input], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _estimate_tokens(self, input) -> int:
+        chars = len(json.dumps(input, default=str)) + sum(len(str(part)) for part in self.key_parts)
+        return chars // 4 + LLM_OUTPUT_TOKEN_ESTIMATE
+
+    def invoke(self, input, config=None, **kwargs):
+        estimated = self._estimate_tokens(input)
+
+        def call():
+            with self.scheduler.slot(self.priority, estimated, self.tier):
+                return self.inner.invoke(input, config, **kwargs)
+
+        return self.scheduler.run_deduplicated(self._key(input), call)
+
+    def stream(self, input, config=None, **kwargs):
+        # Stream không được dùng chung: người dùng có thể huỷ sớm (xem utils.streaming)
+        with self.scheduler.slot(self.priority, self._estimate_tokens(input), self.tier):
+            yield from self.inner.stream(input, config, **kwargs)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
@@ -1,6 +1,9 @@
 # utils/sample_data.py
 import random
 
+# Seed cố định để payload mẫu giống nhau giữa các lần chạy (khoá cassette ổn định)
+_rng = random.Random(0)
+
 # ==============================================================================
 # == CÁC MẪU DỮ LIỆU CƠ BẢN (BASIC DATA SAMPLES)                            ==
 # ==============================================================================
@@ -42,7 +45,7 @@ SAMPLE_TABULAR_PAYLOAD = {
 
 # Dữ liệu cho tác vụ 'audio_classification'
 SAMPLE_AUDIO_PAYLOAD = {
-    "audio_data": [random.uniform(-1.0, 1.0) for _ in range(1500)],
+    "audio_data": [_rng.uniform(-1.0, 1.0) for _ in range(1500)],
     "sampling_rate": 48000
 }
 
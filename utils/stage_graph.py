@@ -0,0 +1,265 @@
+# utils/stage_graph.py
+"""
+Chạy pipeline dưới dạng đồ thị phụ thuộc giữa các stage, có thực thi suy đoán.
+
+Mỗi stage là một hàm đồng bộ fn(inputs, cancel_event) nhận dict {tên dep: kết quả}
+và một threading.Event, trả về kết quả (None = thất bại). Scheduler (asyncio, mỗi
+stage chạy trong thread riêng) khởi động stage ngay khi mọi dep đã xong.
+
+Stage "gate" (vd. step1b) có thể khai báo predict(): khi gate bắt đầu, kết quả
+dự đoán được dùng để chạy trước các stage speculative=True phía sau. Gate nằm sau
+một gate khác (vd. step1d sau step1b) được dự đoán ngay từ kết quả dự đoán của gate
+trước, không phải chờ gate trước chạy xong. Khi gate
+xong, agrees(predicted, actual) trả về danh sách điểm khác nhau:
+    rỗng     -> giữ kết quả suy đoán
+    khác rỗng -> huỷ kết quả suy đoán và chạy lại các stage bị ảnh hưởng
+Thread không dừng được từ bên ngoài, nên cancel_event được set khi kết quả của
+lần chạy không còn dùng được (suy đoán sai, hoặc stage khác thất bại); stage dài
+(sinh code bằng LLM) phải kiểm tra nó và thoát sớm. Một stage chỉ chạy lại sau
+khi lần chạy suy đoán cũ của nó đã dừng, để hai lần chạy không ghi đè file của nhau.
+"""
+import asyncio
+import threading
+import time
+
+
+class Stage:
+    def __init__(self, name: str, fn, deps: tuple = (), speculative: bool = False,
+                 predict=None, agrees=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.speculative = speculative
+        self.predict = predict
+        self.agrees = agrees
+
+
+class StageFailed(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Stage '{stage}' failed")
+        self.stage = stage
+
+
+class StageGraph:
+    def __init__(self, stages: list[Stage], speculate: bool = True):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]  # Đã theo thứ tự topo
+        self.speculate = speculate
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages or self.order.index(dep) > self.order.index(stage.name):
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown or later stage '{dep}'")
+        self.gates = {stage.name for stage in stages if stage.predict}
+        self.runs = []
+        self.results = {}
+
+    # --- Quan hệ giữa các stage ---
+    def _descendants(self, name: str) -> list[str]:
+        found = {name}
+        for other in self.order:
+            if any(dep in found for dep in self.stages[other].deps):
+                found.add(other)
+        return [other for other in self.order if other in found and other != name]
+
+    def run(self) -> dict:
+        """Chạy toàn bộ đồ thị; trả về {tên stage: kết quả}, ném StageFailed nếu một stage thất bại."""
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        self._t0 = time.perf_counter()
+        final, provisional = {}, {}
+        self._available = {}   # thời điểm kết quả (chính thức hoặc suy đoán) sẵn sàng
+        self._promoted_by = {}
+        self._prediction_trigger = {}  # gate -> (dep làm có dự đoán, dep đó có phải dự đoán không)
+        running = {}           # task -> (tên stage, có phải suy đoán, record)
+        cancel_events = {}     # task -> threading.Event truyền cho stage
+        stale = set()          # các task suy đoán đã bị huỷ kết quả
+        spec_failed = set()
+
+        def now():
+            return time.perf_counter() - self._t0
+
+        def launch(name: str, inputs: dict, speculative: bool):
+            stage = self.stages[name]
+            trigger = max(stage.deps, key=lambda dep: self._available.get(dep, 0.0), default=None)
+            record = {"stage": name, "speculative": speculative, "start": now(), "end": None,
+                      "outcome": "running", "trigger": trigger,
+                      # Dep chỉ là giá trị dự đoán của gate: thời điểm có nó do dep của gate quyết định
+                      "predicted_trigger": trigger in provisional and trigger in self.gates}
+            self.runs.append(record)
+            cancel_event = threading.Event()
+            task = asyncio.ensure_future(asyncio.to_thread(stage.fn, inputs, cancel_event))
+            running[task] = (name, speculative, record)
+            cancel_events[task] = cancel_event
+            label = " (speculative)" if speculative else ""
+            print(f"▶️ [DAG] {name}{label} started at {record['start']:.2f}s")
+
+        def predict_gate(name: str, inputs: dict):
+            stage = self.stages[name]
+            predicted = stage.predict(inputs)
+            if predicted is None:
+                return
+            trigger = max(stage.deps, key=lambda dep: self._available.get(dep, 0.0), default=None)
+            self._prediction_trigger[name] = (trigger, trigger in provisional and trigger not in final)
+            provisional[name] = predicted
+            self._available[name] = now()
+
+        def spec_running(name: str) -> bool:
+            return any(n == name and spec for n, spec, _ in running.values())
+
+        def promote(by: str):
+            # `by`: stage vừa xong cho phép chuyển kết quả suy đoán thành chính thức
+            for name in self.order:
+                # Giá trị dự đoán của gate không bao giờ được coi là kết quả chính thức
+                if name in provisional and name not in final and name not in self.gates \
+                        and all(dep in final for dep in self.stages[name].deps):
+                    final[name] = provisional.pop(name)
+                    self._available[name] = now()
+                    if name != by:
+                        self._promoted_by[name] = by
+
+        while True:
+            # Khởi động các stage đã đủ điều kiện
+            for name in self.order:
+                stage = self.stages[name]
+                if name in final or any(n == name and not spec for n, spec, _ in running.values()):
+                    continue
+                if all(dep in final for dep in stage.deps) and not spec_running(name):
+                    inputs = {dep: final[dep] for dep in stage.deps}
+                    if self.speculate and stage.predict and name not in provisional:
+                        predict_gate(name, inputs)
+                    launch(name, inputs, speculative=False)
+                elif (self.speculate and stage.predict and name not in provisional
+                      and all(dep in final or dep in provisional for dep in stage.deps)):
+                    # Dự đoán tiếp từ dự đoán của gate phía trước
+                    predict_gate(name, {dep: final[dep] if dep in final else provisional[dep] for dep in stage.deps})
+                elif (self.speculate and stage.speculative and name not in provisional
+                      and name not in spec_failed and not spec_running(name)
+                      and all(dep in final or dep in provisional for dep in stage.deps)
+                      and any(dep in provisional for dep in stage.deps)):
+                    inputs = {dep: final[dep] if dep in final else provisional[dep] for dep in stage.deps}
+                    launch(name, inputs, speculative=True)
+
+            if not running:
+                break
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name, speculative, record = running.pop(task)
+                cancel_events.pop(task)
+                record["end"] = now()
+                if task in stale:
+                    record["outcome"] = "discarded"
+                    print(f"⏹️ [DAG] {name} (speculative) stopped at {record['end']:.2f}s")
+                    continue
+                try:
+                    result = task.result()
+                except Exception as e:
+                    print(f"❌ [DAG] {name} raised: {e}")
+                    result = None
+
+                if speculative:
+                    if result is None:
+                        record["outcome"] = "failed"
+                        spec_failed.add(name)
+                        continue
+                    record["outcome"] = "kept"
+                    provisional[name] = result
+                    self._available[name] = record["end"]
+                    promote(name)
+                    continue
+
+                if result is None:
+                    record["outcome"] = "failed"
+                    # asyncio.run vẫn chờ các thread đang chạy: báo chúng dừng ngay
+                    for other, (_, _, other_record) in running.items():
+                        cancel_events[other].set()
+                        other_record["outcome"] = "cancelled"
+                    raise StageFailed(name)
+
+                record["outcome"] = "ok"
+                final[name] = result
+                self._available[name] = record["end"]
+                stage = self.stages[name]
+                if name in provisional and stage.predict:
+                    predicted = provisional.pop(name)
+                    differences = stage.agrees(predicted, result) if stage.agrees else []
+                    if differences:
+                        print(f"⚠️ [DAG] {name} disagrees with prediction, re-running: "
+                              f"{', '.join(self._descendants(name))}")
+                        for difference in differences[:10]:
+                            print(f"    {difference}")
+                        # Không chặn chạy suy đoán lại: gate phía sau có thể được dự đoán lại từ
+                        # kết quả thật; lần chạy cũ được huỷ và phải dừng trước (spec_running)
+                        for descendant in self._descendants(name):
+                            provisional.pop(descendant, None)
+                            for other, (n, spec, other_record) in running.items():
+                                if n == descendant and spec:
+                                    stale.add(other)
+                                    cancel_events[other].set()
+                        for other_record in self.runs:
+                            if other_record["speculative"] and other_record["outcome"] == "kept" \
+                                    and other_record["stage"] in self._descendants(name):
+                                other_record["outcome"] = "discarded"
+                    else:
+                        print(f"✅ [DAG] {name} matches prediction, keeping speculative results")
+                        promote(name)
+
+        self.results = final
+        self.wall_s = now()
+        return final
+
+    # --- Báo cáo ---
+    def critical_path(self) -> list[str]:
+        """Chuỗi stage quyết định wall time; `~` đánh dấu kết quả suy đoán được giữ lại."""
+        kept = {r["stage"]: r for r in self.runs if r["outcome"] in ("ok", "kept")}
+        if not kept:
+            return []
+        current = max(self.results, key=lambda name: self._available.get(name, 0.0))
+        path = []
+        # Stage phía sau chạy suy đoán thì dùng kết quả suy đoán ngay khi xong, không chờ xác nhận
+        used_provisional = False
+        while current:
+            record = kept.get(current)
+            if record is None:
+                path.append(current)
+                break
+            path.append(f"{current}~" if record["speculative"] else current)
+            gate = self._promoted_by.get(current)
+            if not used_provisional and gate and self._available[gate] > record["end"]:
+                # Kết quả suy đoán xong trước gate, phải chờ gate xác nhận: gate nằm trên đường găng
+                current = gate
+                continue
+            used_provisional = record["speculative"]
+            current = record["trigger"]
+            predicted = record.get("predicted_trigger")
+            while predicted:
+                # Chạy từ giá trị dự đoán của gate, không chờ gate chạy xong
+                current, predicted = self._prediction_trigger.get(current, (None, False))
+        return list(reversed(path))
+
+    def report(self) -> dict:
+        kept = [r for r in self.runs if r["outcome"] in ("ok", "kept")]
+        wasted = [r for r in self.runs if r["outcome"] in ("discarded", "failed", "cancelled") and r["end"] is not None]
+        sequential = sum(r["end"] - r["start"] for r in kept)
+        return {
+            "wall_s": round(self.wall_s, 2),
+            "sequential_s": round(sequential, 2),
+            "saved_s": round(sequential - self.wall_s, 2),
+            "wasted_s": round(sum(r["end"] - r["start"] for r in wasted), 2),
+            "critical_path": self.critical_path(),
+            "runs": [
+                {"stage": r["stage"], "speculative": r["speculative"], "outcome": r["outcome"],
+                 "start_s": round(r["start"], 2), "end_s": round(r["end"], 2) if r["end"] is not None else None}
+                for r in self.runs
+            ],
+        }
+
+    def print_report(self):
+        report = self.report()
+        print(f"📊 [DAG] wall {report['wall_s']}s vs sequential {report['sequential_s']}s "
+              f"(saved {report['saved_s']}s, wasted {report['wasted_s']}s on discarded runs)")
+        print(f"📊 [DAG] critical path: {' -> '.join(report['critical_path'])}")
+        for run in report["runs"]:
+            marker = "~" if run["speculative"] else " "
+            print(f"    {marker} {run['stage']:<10} {run['outcome']:<9} {run['start_s']:>7.2f}s -> {run['end_s']}s")
@@ -0,0 +1,259 @@
+# utils/streaming.py
+"""
+Sinh code bằng LLM ở chế độ streaming: ghi token ra file khi nhận được, tách
+code block tăng dần, kiểm tra định kỳ phần code đã nhận còn là prefix hợp lệ,
+và huỷ sớm + thử lại khi output chắc chắn không thể thành code hợp lệ.
+"""
+import os
+import re
+import time
+
+from utils.helpers import clean_llm_output
+from utils.llm_router import TIMEOUT_EXCEPTIONS
+from config import (
+    LLM_STREAMING,
+    STREAM_CHECK_INTERVAL,
+    STREAM_MAX_ATTEMPTS,
+)
+
+CODE_FENCE = "```python\n"
+
+# Thông báo SyntaxError cho biết code chỉ đang bị cắt ngang, chưa chắc sai
+_INCOMPLETE_MARKERS = (
+    "was never closed",
+    "unexpected EOF",
+    "expected an indented block",
+    "unterminated triple-quoted string",
+    "incomplete input",
+    "expected 'except' or 'finally' block",
+)
+
+
+class StreamAbort(Exception):
+    """Output đang stream chắc chắn không thể trở thành code hợp lệ."""
+
+
+class StreamTimeout(Exception):
+    """Lời gọi stream vượt quá timeout của tier (tính trên toàn bộ lời gọi, không phải mỗi lần đọc)."""
+
+
+class StreamCancelled(Exception):
+    """Người gọi đã huỷ lần sinh (vd. kết quả suy đoán của stage DAG không còn dùng được)."""
+
+
+class CodeBlockExtractor:
+    """Tách code block tăng dần từ text stream, theo cùng quy tắc với clean_llm_output."""
+
+    def __init__(self):
+        self.text = ""
+        self.fence_start = -1
+        self.closed = False
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        if self.fence_start < 0:
+            index = self.text.find(CODE_FENCE)
+            if index >= 0:
+                self.fence_start = index + len(CODE_FENCE)
+        if self.fence_start >= 0 and not self.closed:
+            self.closed = "```" in self.text[self.fence_start:]
+
+    @property
+    def in_code_block(self) -> bool:
+        return self.fence_start >= 0
+
+    @property
+    def code(self) -> str:
+        if self.fence_start < 0:
+            return self.text
+        body = self.text[self.fence_start:]
+        end = body.find("```")
+        return body if end < 0 else body[:end]
+
+
+def is_valid_prefix(code: str) -> bool:
+    """True nếu các dòng hoàn chỉnh của code có thể là phần đầu của một script hợp lệ."""
+    complete = code[:code.rfind("\n") + 1]
+    if not complete.strip():
+        return True
+    try:
+        compile(complete, "<stream>", "exec")
+        return True
+    except SyntaxError as e:
+        if any(marker in str(e.msg) for marker in _INCOMPLETE_MARKERS):
+            return True
+        # Câu lệnh cuối là decorator (có thể viết trên nhiều dòng): hàm/class phía sau
+        # chưa được stream tới. Thử nối một hàm giả ngay sau decorator.
+        decorators = [line for line in complete.splitlines() if line.lstrip().startswith("@")]
+        if not decorators:
+            return False
+        indent = decorators[-1][:len(decorators[-1]) - len(decorators[-1].lstrip())]
+        try:
+            compile(f"{complete}{indent}def _stream_placeholder(): pass\n", "<stream>", "exec")
+            return True
+        except SyntaxError:
+            return False
+
+
+def find_forbidden_post(code: str, allowed_functions: set) -> int | None:
+    """Trả về số dòng có requests.post nằm ngoài các hàm được phép, hoặc None."""
+    current_function = None
+    for lineno, line in enumerate(code.splitlines(), start=1):
+        match = re.match(r"(?:async\s+)?def\s+(\w+)\s*\(", line)
+        if match:
+            current_function = match.group(1)
+        elif line and not line[0].isspace() and not line.startswith(("#", "@", ")")):
+            current_function = None
+        if "requests.post(" in line and current_function not in allowed_functions:
+            return lineno
+    return None
+
+
+def _check(extractor: CodeBlockExtractor, allowed_post_functions: set | None):
+    if not extractor.in_code_block:
+        # Lời giải thích trước code block dài bao nhiêu cũng hợp lệ: code block vẫn có thể
+        # tới sau. Output không có code block được xử lý ở bước compile cuối.
+        return
+
+    code = extractor.code
+    if not is_valid_prefix(code):
+        raise StreamAbort("code received so far is not valid Python")
+    if allowed_post_functions is not None:
+        lineno = find_forbidden_post(code, allowed_post_functions)
+        if lineno is not None:
+            raise StreamAbort(f"direct requests.post outside the API handler (line {lineno})")
+
+
+def _stream_once(chain, user_prompt: str, stream_path: str | None,
+                 allowed_post_functions: set | None, stats: dict, cancel_event=None,
+                 timeout: float | None = None) -> str:
+    extractor = CodeBlockExtractor()
+    tokens = 0
+    checked_len = 0
+    start = time.perf_counter()
+    started = time.monotonic()
+    stream_file = open(stream_path, "w", encoding="utf-8") if stream_path else None
+
+    stream = chain.stream({"user_prompt": user_prompt})
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                raise StreamCancelled("generation cancelled")
+            # Timeout của client chỉ áp cho từng lần đọc: token nhỏ giọt không bao giờ bị cắt
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise StreamTimeout(f"no complete answer after {timeout}s")
+            if not chunk:
+                continue
+            if stats["ttfb_s"] is None:
+                stats["ttfb_s"] = time.perf_counter() - start
+            tokens += 1
+            extractor.feed(chunk)
+            if stream_file:
+                stream_file.write(chunk)
+                stream_file.flush()
+
+            if len(extractor.text) - checked_len >= STREAM_CHECK_INTERVAL:
+                checked_len = len(extractor.text)
+                _check(extractor, allowed_post_functions)
+            if extractor.closed:
+                # Code block đã đóng: phần còn lại chỉ là lời giải thích
+                break
+    except StreamAbort:
+        stats["aborted_tokens"].append(tokens)
+        raise
+    finally:
+        # Đóng stream ngay để giải phóng kết nối và slot của scheduler
+        stream.close()
+        stats["tokens_received"] += tokens
+        if stream_file:
+            stream_file.close()
+
+    code = clean_llm_output(extractor.text)
+    try:
+        compile(code, "<generated>", "exec")
+    except SyntaxError as e:
+        # Đã nhận hết output: không tiết kiệm được token nào, không tính là huỷ sớm
+        stats["rejected_tokens"].append(tokens)
+        raise StreamAbort(f"final code does not compile (line {e.lineno}: {e.msg})")
+    if allowed_post_functions is not None:
+        lineno = find_forbidden_post(code, allowed_post_functions)
+        if lineno is not None:
+            stats["rejected_tokens"].append(tokens)
+            raise StreamAbort(f"direct requests.post outside the API handler (line {lineno})")
+
+    stats["completion_tokens"] = tokens
+    return code
+
+
+def generate_code(chain, user_prompt: str, stream_path: str | None = None,
+                  allowed_post_functions: set | None = None, label: str = "LLM",
+                  cancel_event=None) -> tuple[str, dict]:
+    """
+    Sinh code từ chain và trả về (code đã làm sạch, thống kê).
+
+    Args:
+        chain: LangChain runnable trả về chuỗi (create_llm_chain).
+        user_prompt (str): Prompt người dùng.
+        stream_path (str | None): File nhận token thô khi đang stream.
+        allowed_post_functions (set | None): Các hàm được phép gọi requests.post.
+            None nghĩa là không kiểm tra.
+        label (str): Tên bước, dùng khi in log.
+            Khi chain có timeout/fallback (create_llm_chain), mỗi lần stream bị giới hạn
+            theo timeout của tier; quá hạn thì lần thử sau dùng tier dự phòng.
+        cancel_event (threading.Event | None): Khi được set, dừng stream ở chunk
+            tiếp theo và ném StreamCancelled (không thử lại).
+
+    Số token được đếm theo số chunk stream (mỗi chunk xấp xỉ một token). Token
+    tiết kiệm được ước lượng bằng độ dài lần sinh thành công trừ đi số token đã
+    nhận ở mỗi lần bị huỷ sớm. Lần sinh chỉ bị loại sau khi đã nhận hết output
+    (không compile được) được đếm riêng trong rejected_tokens.
+    """
+    stats = {"ttfb_s": None, "tokens_received": 0, "completion_tokens": 0,
+             "aborted_tokens": [], "rejected_tokens": [], "attempts": 0, "tokens_saved": 0}
+
+    if not LLM_STREAMING:
+        stats["attempts"] = 1
+        return clean_llm_output(chain.invoke({"user_prompt": user_prompt})), stats
+
+    prompt = user_prompt
+    last_reason = ""
+    current = chain
+    for attempt in range(STREAM_MAX_ATTEMPTS):
+        if cancel_event is not None and cancel_event.is_set():
+            raise StreamCancelled("generation cancelled")
+        stats["attempts"] = attempt + 1
+        try:
+            code = _stream_once(current, prompt, stream_path, allowed_post_functions, stats, cancel_event,
+                                getattr(current, "timeout", None))
+            break
+        except StreamCancelled:
+            raise
+        except (StreamTimeout, *TIMEOUT_EXCEPTIONS) as e:
+            last_reason = f"{type(e).__name__}: {e}"
+            fallback = getattr(current, "fallback", None)
+            if fallback is not None:
+                print(f"⚠️ [{label}] Tier '{current.tier}' timed out ({last_reason}); "
+                      f"retrying on fallback tier '{fallback.tier}'")
+                current = fallback
+            else:
+                print(f"⚠️ [{label}] Streaming attempt {attempt + 1}/{STREAM_MAX_ATTEMPTS} timed out: {last_reason}")
+        except StreamAbort as e:
+            last_reason = str(e)
+            print(f"⚠️ [{label}] Streaming attempt {attempt + 1}/{STREAM_MAX_ATTEMPTS} aborted: {last_reason}")
+            prompt = (f"{user_prompt}\n\nA previous answer was rejected because: {last_reason}. "
+                      f"Reply with a single complete ```python code block only.")
+        except Exception as e:
+            # Lỗi tạm thời giữa chừng (timeout đọc, mất kết nối): thử lại với cùng prompt
+            last_reason = f"{type(e).__name__}: {e}"
+            print(f"⚠️ [{label}] Streaming attempt {attempt + 1}/{STREAM_MAX_ATTEMPTS} failed: {last_reason}")
+    else:
+        raise ValueError(f"[{label}] LLM generation failed after {STREAM_MAX_ATTEMPTS} attempts: {last_reason}")
+
+    stats["tokens_saved"] = sum(max(0, stats["completion_tokens"] - t) for t in stats["aborted_tokens"])
+    if stream_path and os.path.exists(stream_path):
+        os.remove(stream_path)
+
+    ttfb = f"{stats['ttfb_s']:.2f}s" if stats["ttfb_s"] is not None else "n/a"
+    print(f"📊 [{label}] TTFB: {ttfb} | tokens: {stats['completion_tokens']} | "
+          f"early aborts: {len(stats['aborted_tokens'])} | final rejects: {len(stats['rejected_tokens'])} | tokens saved: ~{stats['tokens_saved']}")
+    return code, stats